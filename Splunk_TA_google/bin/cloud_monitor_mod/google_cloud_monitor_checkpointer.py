@@ -1,6 +1,11 @@
 import base64
+import threading
+import time
 from datetime import datetime
 from datetime import timedelta
+# Import _strptime ahead, datetime.strptime imports it lazily which is not
+# thread safe
+import _strptime  # noqa
 
 import splunktalib.state_store as sss
 import google_ta_common.google_consts as ggc
@@ -32,6 +37,16 @@ def strf_metric_date(metric_date):
     return "{}-00:00".format(mdate)
 
 
+def floor_metric_date(metric_date, period):
+    """
+    return the latest multiple of period seconds since epoch which is not
+    after metric_date
+    """
+
+    seconds = (metric_date - datetime(1970, 1, 1)).total_seconds()
+    return metric_date - timedelta(seconds=seconds % period)
+
+
 def calculate_youngest(oldest, polling_interval, now, win=3600):
     """
     return (youngest, done)
@@ -47,10 +62,43 @@ def calculate_youngest(oldest, polling_interval, now, win=3600):
     return (youngest, done)
 
 
+def calculate_win(win, points, seconds, target_points, min_win, max_win):
+    """
+    Size the next window to hold about target_points points according to
+    the point density of the last window, which had points points in
+    seconds seconds. The window grows by at most 2 times each step, and
+    does not grow after a last window cut short by now.
+    return new win in seconds
+    """
+
+    if seconds <= 0:
+        return win
+
+    if points:
+        new_win = int(target_points * seconds / points)
+    else:
+        new_win = win * 2
+
+    if seconds < win:
+        new_win = min(new_win, win)
+    else:
+        new_win = min(new_win, win * 2)
+    return max(min_win, min(new_win, max_win))
+
+
 class GoogleCloudMonitorCheckpointer(object):
+    """
+    Write-behind checkpointer. oldest moves in memory right away, committed
+    checkpoints are coalesced and saved once checkpoint_windows of them
+    are pending or checkpoint_interval seconds passed since the last save,
+    and by flush. Only committed checkpoints are saved, so the saved one is
+    never ahead of what the caller committed.
+    """
 
     def __init__(self, config):
         self._config = config
+        self._commit_windows = int(config.get(gmc.checkpoint_windows, 100))
+        self._commit_interval = int(config.get(gmc.checkpoint_interval, 30))
         key = "{stanza_name}|{metric_name}".format(
             stanza_name=config[ggc.name],
             metric_name=config[gmc.google_metric])
@@ -59,6 +107,10 @@ class GoogleCloudMonitorCheckpointer(object):
             config, config[ggc.appname], collection_name=self._key,
             use_kv_store=config.get(ggc.use_kv_store))
         self._state = self._get_state()
+        self._committed_oldest = self._state[gmc.oldest]
+        self._uncommitted = 0
+        self._last_flush = time.time()
+        self._lock = threading.Lock()
 
     def _get_state(self):
         state = self._store.get_state(self._key)
@@ -72,11 +124,55 @@ class GoogleCloudMonitorCheckpointer(object):
     def oldest(self):
         return self._state[gmc.oldest]
 
+    def win(self):
+        return self._state.get(gmc.cm_win)
+
+    def set_win(self, win):
+        """
+        The win is persisted together with the next set_oldest
+        """
+
+        self._state[gmc.cm_win] = win
+
     def set_oldest(self, oldest, commit=True):
+        """
+        :param commit: commit oldest as well, otherwise it only moves in
+        memory and is committed later by commit
+        """
+
         oldest = strip_off_timezone(oldest)
         self._state[gmc.oldest] = oldest
         if commit:
-            self._store.update_state(self._key, self._state)
+            self.commit(oldest)
+
+    def commit(self, oldest, windows=1):
+        """
+        Commit oldest when everything before it has been written
+        :param windows: number of windows oldest moves past
+        """
+
+        with self._lock:
+            self._committed_oldest = strip_off_timezone(oldest)
+            self._uncommitted += windows
+            if (self._uncommitted >= self._commit_windows or
+                    time.time() - self._last_flush >= self._commit_interval):
+                self._flush_with_lock()
+
+    def flush(self):
+        """
+        Save the last committed checkpoint if it is not saved yet
+        """
+
+        with self._lock:
+            if self._uncommitted:
+                self._flush_with_lock()
+
+    def _flush_with_lock(self):
+        state = dict(self._state)
+        state[gmc.oldest] = self._committed_oldest
+        self._store.update_state(self._key, state)
+        self._uncommitted = 0
+        self._last_flush = time.time()
 
     def delete(self):
         self._store.delete_state(self._key)
@@ -4,3 +4,21 @@ monitor_ns = "splunk_ta_google_cloud_monitor"
 google_metric = "google_metric"
 youngest = "youngest"
 oldest = "oldest"
+
+cm_win = "cm_win"
+backfill_concurrency = "backfill_concurrency"
+group_metrics = "group_metrics"
+metric_concurrency = "metric_concurrency"
+adaptive_win = "adaptive_win"
+min_win = "min_win"
+max_win = "max_win"
+target_points = "target_points"
+descriptor_ttl = "descriptor_ttl"
+event_format = "event_format"
+alignment_period = "alignment_period"
+reducer = "reducer"
+checkpoint_windows = "checkpoint_windows"
+checkpoint_interval = "checkpoint_interval"
+monitoring_api = "monitoring_api"
+metric_filter = "metric_filter"
+page_size = "page_size"
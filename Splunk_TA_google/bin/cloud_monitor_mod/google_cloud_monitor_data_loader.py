@@ -1,5 +1,8 @@
+import collections
+import sys
 import traceback
 import threading
+import Queue
 import time
 from datetime import datetime
 
@@ -7,10 +10,16 @@ from splunktalib.common import log
 logger = log.Logs().get_logger("main")
 
 
+import splunktalib.common.util as utils
 import google_ta_common.google_consts as ggc
 import google_wrapper.cloud_monitor_wrapper as gmw
 import cloud_monitor_mod.google_cloud_monitor_consts as gmc
 import cloud_monitor_mod.google_cloud_monitor_checkpointer as ckpt
+import cloud_monitor_mod.google_cloud_monitor_event_formatter as gmef
+
+
+def _count_points(metrics):
+    return sum(len(metric.get("points") or ()) for metric in metrics)
 
 
 class GoogleCloudMonitorDataLoader(object):
@@ -40,8 +49,17 @@ class GoogleCloudMonitorDataLoader(object):
             project=self._config[ggc.google_project],
             metric=self._config[gmc.google_metric])
         self._store = ckpt.GoogleCloudMonitorCheckpointer(config)
+        self._formatter = gmef.GoogleCloudMonitorEventFormatter(
+            config.get(gmc.event_format, gmef.timeseries_format))
         self._lock = threading.Lock()
         self._stopped = False
+        # Windows are committed once their events are written, the number
+        # of writes handed over and written tells which ones can be
+        self._handed_writes = 0
+        self._written_writes = 0
+        # (handed writes, youngest of window)
+        self._pending_windows = collections.deque()
+        self._written_lock = threading.Lock()
 
     def get_interval(self):
         return self._config[ggc.polling_interval]
@@ -51,12 +69,17 @@ class GoogleCloudMonitorDataLoader(object):
 
     def stop(self):
         self._stopped = True
-        logger.info("Stopping GooglePubSubDataLoader")
+        logger.info("Stopping GoogleCloudMonitorDataLoader")
 
     def __call__(self):
         self.index_data()
 
-    def index_data(self):
+    def index_data(self, mon=None):
+        """
+        :param mon: GoogleCloudMonitor client to collect with, a new one is
+        created when it is None
+        """
+
         if self._lock.locked():
             logger.info("Last time of data collection for project=%s, "
                         "metric=%s is not done",
@@ -65,68 +88,448 @@ class GoogleCloudMonitorDataLoader(object):
             return
 
         with self._lock:
-            self._do_index()
+            self._do_index(mon)
 
-    def _do_index(self):
+    def _do_index(self, mon):
         logger.info("Start collecting data for project=%s, metric=%s, from=%s",
                     self._config[ggc.google_project],
                     self._config[gmc.google_metric],
                     self._store.oldest())
         try:
-            self._do_safe_index()
+            self._do_safe_index(mon)
         except Exception:
             logger.error(
                 "Failed to collect data for project=%s, metric=%s, error=%s",
                 self._config[ggc.google_project],
                 self._config[gmc.google_metric], traceback.format_exc())
+        finally:
+            self._commit_written_windows()
+            self._store.flush()
         logger.info("End of collecting data for project=%s, metric=%s",
                     self._config[ggc.google_project],
                     self._config[gmc.google_metric])
 
-    def _do_safe_index(self):
-        # 1) Cache max_events in memory before indexing for batch processing
+    def _do_safe_index(self, mon):
+        now = datetime.utcnow()
+        windows = self._get_windows(now)
+        concurrency = int(self._config.get(gmc.backfill_concurrency, 1))
+        if concurrency > 1 and len(windows) > 1:
+            self._index_windows_concurrently(windows, concurrency)
+        else:
+            self._index_windows(now, mon)
+
+    def _get_win(self):
+        win = int(self._config.get(gmc.cm_win, 3600))
+        if utils.is_true(self._config.get(gmc.adaptive_win)):
+            win = self._store.win() or win
+        return win
+
+    def _get_alignment_period(self):
+        if (self._config.get(gmc.alignment_period) and
+                self._config.get(gmc.reducer)):
+            return int(self._config[gmc.alignment_period])
+        return 0
+
+    def _get_window(self, oldest, now):
+        """
+        :return: ((oldest, youngest), done), the window starts from oldest.
+        Aligned windows end on alignment period boundaries, the window is
+        None when no period ends before now
+        """
 
-        params = {
+        oldest = ckpt.strp_metric_date(oldest)
+        win, period = self._get_win(), self._get_alignment_period()
+        if period:
+            win = max(win, period)
+        youngest, done = ckpt.calculate_youngest(
+            oldest, self._config[ggc.polling_interval], now, win)
+        if period:
+            # A period is aggregated from the points of one window, so it
+            # must not be split by a window end, including the one at now
+            youngest = ckpt.floor_metric_date(youngest, period)
+            if youngest <= oldest:
+                return None, True
+        return (ckpt.strf_metric_date(oldest),
+                ckpt.strf_metric_date(youngest)), done
+
+    def _get_windows(self, now):
+        """
+        Split [checkpoint, now] into windows of the current win
+        :return: a list of (oldest, youngest) metric date strings
+        """
+
+        oldest, done, windows = self._store.oldest(), False, []
+        while not done:
+            window, done = self._get_window(oldest, now)
+            if window is None:
+                break
+            windows.append(window)
+            oldest = window[1]
+        return windows
+
+    def _commit_window(self, window, points, done):
+        """
+        Move the checkpoint past window, which had points data points. It is
+        committed once all events handed over so far are written. With
+        adaptive_win, the win of the next windows is sized from the point
+        density of this one and saved along with the checkpoint.
+        :param done: True if window is the last one, which is cut short by
+        now
+        """
+
+        if utils.is_true(self._config.get(gmc.adaptive_win)):
+            seconds = (ckpt.strp_metric_date(window[1]) -
+                       ckpt.strp_metric_date(window[0])).total_seconds()
+            # Concurrent windows may be sized by an earlier win, grow from
+            # the length the window really had
+            win = self._get_win() if done else int(seconds)
+            new_win = ckpt.calculate_win(
+                win, points, seconds,
+                int(self._config.get(gmc.target_points, 10000)),
+                int(self._config.get(gmc.min_win, 300)),
+                int(self._config.get(gmc.max_win, 86400)))
+            if new_win != win:
+                logger.info("Change win from %s to %s for project=%s, "
+                            "metric=%s, points=%s in %s seconds", win,
+                            new_win, self._config[ggc.google_project],
+                            self._config[gmc.google_metric], points, seconds)
+            self._store.set_win(new_win)
+        self._store.set_oldest(window[1], commit=False)
+        self._pending_windows.append((self._handed_writes, window[1]))
+        self._commit_written_windows()
+
+    def _commit_written_windows(self):
+        with self._written_lock:
+            written_writes = self._written_writes
+
+        oldest, windows = None, 0
+        pending = self._pending_windows
+        while pending and pending[0][0] <= written_writes:
+            oldest = pending.popleft()[1]
+            windows += 1
+        if oldest is not None:
+            self._store.commit(oldest, windows)
+
+    def _on_written(self):
+        with self._written_lock:
+            self._written_writes += 1
+
+    def _get_params(self, window):
+        logger.debug("Collect data for project=%s, metric=%s, win=[%s, %s]",
+                     self._config[ggc.google_project],
+                     self._config[gmc.google_metric], window[0], window[1])
+        return {
             ggc.google_project: self._config[ggc.google_project],
             gmc.google_metric: self._config[gmc.google_metric],
+            gmc.oldest: window[0],
+            gmc.youngest: window[1],
+            gmc.alignment_period: self._config.get(gmc.alignment_period),
+            gmc.reducer: self._config.get(gmc.reducer),
+            gmc.metric_filter: self._config.get(gmc.metric_filter),
+            gmc.page_size: self._config.get(gmc.page_size),
         }
 
-        mon = gmw.GoogleCloudMonitor(logger, self._config)
-        now = datetime.utcnow()
-        oldest = ckpt.strp_metric_date(self._store.oldest())
-        polling_interval = self._config[ggc.polling_interval]
-        done, win = False, int(self._config.get("cm_win", 3600))
+    def _index_windows(self, now, mon):
+        if mon is not None:
+            self._do_index_windows(now, mon)
+            return
+
+        mon = gmw.create_cloud_monitor(logger, self._config)
+        try:
+            self._do_index_windows(now, mon)
+        finally:
+            mon.close()
+
+    def _do_index_windows(self, now, mon):
+        done = False
         while not done and not self._stopped:
-            youngest, done = ckpt.calculate_youngest(
-                oldest, polling_interval, now, win)
-            params[gmc.oldest] = ckpt.strf_metric_date(oldest)
-            params[gmc.youngest] = ckpt.strf_metric_date(youngest)
-            logger.debug("Collect data for project=%s, metric=%s, win=[%s, %s]",
-                         params[ggc.google_project], params[gmc.google_metric],
-                         params[gmc.oldest], params[gmc.youngest])
-
-            metrics = mon.list_metrics(params)
-            if metrics:
-                self._write_events(metrics)
-            self._store.set_oldest(params[gmc.youngest])
-            oldest = youngest
+            # The window is sized after the last one is committed
+            window, done = self._get_window(self._store.oldest(), now)
+            if window is None:
+                break
+
+            # Write page by page, only commit the checkpoint after the
+            # whole window is written
+            points = 0
+            for metrics in mon.iter_metrics(self._get_params(window)):
+                if not self._write_events(metrics):
+                    return
+                points += _count_points(metrics)
+            self._commit_window(window, points, done)
+
+    def _index_windows_concurrently(self, windows, concurrency):
+        """
+        Fetch up to concurrency windows at the same time on dedicated
+        threads, and write them in window order page by page while they are
+        fetched. A fetch buffers at most 2 pages ahead of the writing, so
+        memory stays bounded. The checkpoint only moves past a window when
+        all windows before it are written, so a failed window is fetched
+        again next time together with the ones after it.
+        """
+
+        windows = collections.deque(windows)
+        in_flight = collections.deque()
+        work = Queue.Queue()
+        aborted = threading.Event()
+
+        def submit():
+            window = windows.popleft()
+            pages = Queue.Queue(2)
+            in_flight.append((window, pages))
+            work.put((window, pages))
+
+        fetchers = []
+        for _ in xrange(min(concurrency, len(windows))):
+            submit()
+            fetcher = threading.Thread(
+                target=self._fetch_windows, args=(work, aborted))
+            fetcher.daemon = True
+            fetcher.start()
+            fetchers.append(fetcher)
+
+        try:
+            while in_flight:
+                window, pages = in_flight.popleft()
+                points = 0
+                while 1:
+                    kind, value = self._get_page(pages)
+                    if kind == "stopped":
+                        return
+                    elif kind == "error":
+                        raise value[0], value[1], value[2]
+                    elif kind == "done":
+                        break
+
+                    if not self._write_events(value):
+                        return
+                    points += _count_points(value)
+                self._commit_window(
+                    window, points, not windows and not in_flight)
+
+                if windows:
+                    submit()
+        finally:
+            aborted.set()
+            for _ in fetchers:
+                work.put(None)
+
+    def _fetch_windows(self, work, aborted):
+        """
+        Runs in a fetcher thread, httplib2 is not thread safe, so each
+        fetcher uses its own client. Pages of a window are followed by
+        ("done", None), or ("error", exc_info) when the fetch fails.
+        """
+
+        mon = None
+        try:
+            while 1:
+                item = work.get()
+                if item is None:
+                    return
+
+                window, pages = item
+                try:
+                    if mon is None:
+                        mon = gmw.create_cloud_monitor(
+                            logger, dict(self._config))
+                    for metrics in mon.iter_metrics(self._get_params(window)):
+                        if not self._put_page(
+                                pages, ("page", metrics), aborted):
+                            return
+                    result = ("done", None)
+                except Exception:
+                    result = ("error", sys.exc_info())
+                    if mon is not None:
+                        mon.close()
+                        mon = None
+
+                if not self._put_page(pages, result, aborted):
+                    return
+        finally:
+            if mon is not None:
+                mon.close()
+
+    def _put_page(self, pages, item, aborted):
+        """
+        :return: False if the loader is stopped or the writing is aborted
+        before item is put
+        """
+
+        while not self._stopped and not aborted.is_set():
+            try:
+                pages.put(item, timeout=1)
+                return True
+            except Queue.Full:
+                pass
+        return False
+
+    def _get_page(self, pages):
+        while not self._stopped:
+            try:
+                return pages.get(timeout=1)
+            except Queue.Empty:
+                pass
+        return "stopped", None
 
     def _write_events(self, metrics):
-        msgs_str = [metric for metric in metrics]
+        """
+        :return: True if the events have been handed over to the event
+        writer, False if the loader is stopped before that
+        """
+
+        msgs_str, times = self._formatter.format(metrics)
+        if not msgs_str:
+            return True
+
         events = self._config[ggc.event_writer].create_events(
             index=self._config[ggc.index], host=None, source=self._source,
-            sourcetype="google:cloudmonitor", time=None, unbroken=False,
+            sourcetype="google:cloudmonitor", time=times, unbroken=False,
             done=False, events=msgs_str)
 
         while not self._stopped:
             try:
-                self._config[ggc.event_writer].write_events(events)
+                self._config[ggc.event_writer].write_events(
+                    events, callback=self._on_written)
+                self._handed_writes += 1
+                return True
             except Exception:
                 logger.error(
                     "Failed to index events for project=%s, metric=%s, "
                     "error=%s", self._config[ggc.google_project],
                     self._config[gmc.google_metric], traceback.format_exc())
                 time.sleep(2)
+        return False
+
+
+class GoogleCloudMonitorGroupDataLoader(object):
+    """
+    Collect the metrics of the tasks sharing a project, a credential and a
+    monitoring API in one scheduled pass. Up to metric_concurrency metrics
+    are collected at the same time by dedicated workers, each worker reuses
+    one client for all the metrics it collects, clients are leased from the
+    process wide client registry. Every metric keeps its own checkpoint.
+    """
+
+    def __init__(self, configs):
+        """
+        :configs: a list of GoogleCloudMonitorDataLoader configs with the
+        same google_project, google_credentials_name and monitoring_api
+        """
+
+        self._loaders = [GoogleCloudMonitorDataLoader(config)
+                         for config in configs]
+        self._config = {
+            ggc.google_project: configs[0][ggc.google_project],
+            ggc.polling_interval: min(
+                loader.get_interval() for loader in self._loaders),
+            gmc.metric_concurrency: int(
+                configs[0].get(gmc.metric_concurrency, 4)),
+        }
+        self._lock = threading.Lock()
+        self._stopped = False
+
+    def get_interval(self):
+        return self._config[ggc.polling_interval]
+
+    def get_props(self):
+        return self._config
+
+    def stop(self):
+        self._stopped = True
+        for loader in self._loaders:
+            loader.stop()
+        logger.info("Stopping GoogleCloudMonitorGroupDataLoader")
+
+    def __call__(self):
+        self.index_data()
+
+    def index_data(self):
+        if self._lock.locked():
+            logger.info("Last time of data collection for project=%s "
+                        "is not done", self._config[ggc.google_project])
+            return
+
+        with self._lock:
+            self._do_index()
+
+    def _do_index(self):
+        logger.info("Start collecting %d metrics for project=%s",
+                    len(self._loaders), self._config[ggc.google_project])
+
+        loaders = Queue.Queue()
+        for loader in self._loaders:
+            # The data loader manager only hands over its facilities to the
+            # jobs it schedules, which is this group loader
+            for key in (ggc.event_writer, "data_loader_mgr"):
+                if key in self._config:
+                    loader.get_props()[key] = self._config[key]
+            loaders.put(loader)
+
+        concurrency = min(self._config[gmc.metric_concurrency],
+                          len(self._loaders))
+        # Dedicated threads, this pass already holds a thread of the pool
+        # and must not wait for jobs queued behind it
+        workers = []
+        for _ in xrange(concurrency - 1):
+            worker = threading.Thread(target=self._collect, args=(loaders,))
+            worker.daemon = True
+            worker.start()
+            workers.append(worker)
+        self._collect(loaders)
+
+        for worker in workers:
+            worker.join()
+
+        logger.info("End of collecting %d metrics for project=%s",
+                    len(self._loaders), self._config[ggc.google_project])
+
+    def _collect(self, loaders):
+        try:
+            self._do_collect(loaders)
+        except Exception:
+            logger.error("Failed to collect metrics for project=%s, "
+                         "error=%s", self._config[ggc.google_project],
+                         traceback.format_exc())
+
+    def _do_collect(self, loaders):
+        mon = None
+        try:
+            while not self._stopped:
+                try:
+                    loader = loaders.get_nowait()
+                except Queue.Empty:
+                    break
+
+                if mon is None:
+                    mon = gmw.create_cloud_monitor(
+                        logger, dict(loader.get_props()))
+                loader.index_data(mon)
+        finally:
+            if mon is not None:
+                mon.close()
+
+
+def create_data_loaders(configs):
+    """
+    Create a GoogleCloudMonitorGroupDataLoader for each project,
+    credential and monitoring API of the tasks with group_metrics enabled,
+    since the metrics of a group share clients, and a
+    GoogleCloudMonitorDataLoader for each of the other tasks
+    """
+
+    loaders, groups = [], collections.OrderedDict()
+    for config in configs:
+        if utils.is_true(config.get(gmc.group_metrics)):
+            key = (config[ggc.google_project],
+                   config[ggc.google_credentials_name],
+                   config.get(gmc.monitoring_api) or "v2beta2")
+            groups.setdefault(key, []).append(config)
+        else:
+            loaders.append(GoogleCloudMonitorDataLoader(config))
+
+    for group in groups.itervalues():
+        loaders.append(GoogleCloudMonitorGroupDataLoader(group))
+    return loaders
 
 
 if __name__ == "__main__":
@@ -0,0 +1,172 @@
+import base64
+import bisect
+import fnmatch
+import time
+import traceback
+
+from splunktalib.common import log
+logger = log.Logs().get_logger("main")
+
+
+import splunktalib.state_store as sss
+import google_ta_common.google_consts as ggc
+import google_wrapper.cloud_monitor_wrapper as gmw
+import cloud_monitor_mod.google_cloud_monitor_consts as gmc
+
+
+def is_wildcard(metric):
+    return "*" in metric or "?" in metric
+
+
+class GoogleMetricDescriptorCache(object):
+    """
+    Cache the metric names of a project in the checkpoint dir. The names
+    are listed from the metric descriptors again when the cache is older
+    than ttl seconds, a stale cache is used when the listing fails. Names
+    are kept sorted, so metrics of a prefix pattern like
+    pubsub.googleapis.com/* are looked up by bisection.
+    """
+
+    def __init__(self, config, ttl=86400):
+        """
+        :config: dict object
+        {
+            "appname": xxx,
+            "checkpoint_dir": xxx,
+            "proxy_url": xxx,
+            "proxy_port": xxx,
+            "proxy_username": xxx,
+            "proxy_password": xxx,
+            "proxy_rdns": xxx,
+            "proxy_type": xxx,
+            "google_credentials": xxx,
+            "google_credentials_name": xxx,
+            "google_project": xxx,
+        }
+        """
+
+        self._config = config
+        self._ttl = ttl
+        key = "{credentials}|{project}|metric_descriptors".format(
+            credentials=config[ggc.google_credentials_name],
+            project=config[ggc.google_project])
+        self._key = base64.urlsafe_b64encode(key)
+        self._store = sss.FileStateStore(config, config[ggc.appname])
+        self._state = self._store.get_state(self._key) or {
+            "metrics": [],
+            "refreshed": 0,
+            "version": 1,
+        }
+
+    def metrics(self):
+        """
+        :return: sorted metric names, refreshed when the cache expires
+        """
+
+        if time.time() - self._state["refreshed"] >= self._ttl:
+            self.refresh()
+        return self._state["metrics"]
+
+    def refresh(self):
+        mon = None
+        try:
+            mon = gmw.create_cloud_monitor(logger, dict(self._config))
+            descriptors = mon.metirc_descriptors(
+                self._config[ggc.google_project])
+        except Exception:
+            logger.error("Failed to refresh metric descriptors for "
+                         "project=%s, use the cached ones, error=%s",
+                         self._config[ggc.google_project],
+                         traceback.format_exc())
+            return
+        finally:
+            if mon is not None:
+                mon.close()
+
+        # v3 descriptors name the metric by type
+        self._state["metrics"] = sorted(
+            set(descriptor.get("type") or descriptor["name"]
+                for descriptor in descriptors))
+        self._state["refreshed"] = time.time()
+        self._store.update_state(self._key, self._state)
+        logger.info("Refreshed %d metric descriptors for project=%s",
+                    len(self._state["metrics"]),
+                    self._config[ggc.google_project])
+
+    def match(self, pattern):
+        """
+        :pattern: metric name pattern, for instance pubsub.googleapis.com/*
+        :return: sorted metric names matching the pattern
+        """
+
+        metrics = self.metrics()
+        prefix = pattern[:-1]
+        if not pattern.endswith("*") or is_wildcard(prefix):
+            return fnmatch.filter(metrics, pattern)
+
+        start = bisect.bisect_left(metrics, prefix)
+        end = start
+        while end < len(metrics) and metrics[end].startswith(prefix):
+            end += 1
+        return metrics[start:end]
+
+
+def expand_wildcard_metrics(tasks):
+    """
+    Replace each task whose google_metric is a wildcard pattern by a task
+    for each metric of its project matching it. A metric is collected once
+    per input even if several patterns or names of the input match it.
+    :return: expanded tasks
+    """
+
+    caches, all_tasks, seen = {}, [], set()
+    for task in tasks:
+        pattern = task[gmc.google_metric]
+        if not is_wildcard(pattern):
+            if (task[ggc.name], pattern) not in seen:
+                seen.add((task[ggc.name], pattern))
+                all_tasks.append(task)
+            continue
+
+        key = (task[ggc.google_credentials_name], task[ggc.google_project])
+        if key not in caches:
+            caches[key] = GoogleMetricDescriptorCache(
+                task, int(task.get(gmc.descriptor_ttl, 86400)))
+
+        metrics = caches[key].match(pattern)
+        logger.info("Metric pattern=%s of project=%s matches %d metrics",
+                    pattern, task[ggc.google_project], len(metrics))
+        for metric in metrics:
+            if (task[ggc.name], metric) in seen:
+                continue
+
+            seen.add((task[ggc.name], metric))
+            new_task = dict(task)
+            new_task[gmc.google_metric] = metric
+            all_tasks.append(new_task)
+    return all_tasks
+
+
+def get_metric_change_handler(tasks, expanded_tasks, callback):
+    """
+    :tasks: tasks before expand_wildcard_metrics
+    :expanded_tasks: tasks returned by expand_wildcard_metrics(tasks)
+    :callback: called with the metrics added or removed since the last
+    call, when the refreshed descriptors match other metrics
+    :return: a callable to be run periodically
+    """
+
+    def _metrics(expanded_tasks):
+        return set((task[ggc.name], task[gmc.google_metric])
+                   for task in expanded_tasks)
+
+    last_metrics = [_metrics(expanded_tasks)]
+
+    def check_metric_change():
+        metrics = _metrics(expand_wildcard_metrics(tasks))
+        changed = metrics ^ last_metrics[0]
+        last_metrics[0] = metrics
+        if changed:
+            callback(sorted(metric for _, metric in changed))
+
+    return check_metric_change
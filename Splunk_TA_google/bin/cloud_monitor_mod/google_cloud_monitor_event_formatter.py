@@ -0,0 +1,146 @@
+import json
+import re
+
+import google_ta_common.google_time_parser as gtp
+
+
+timeseries_format = "timeseries"
+point_format = "point"
+kv_format = "kv"
+
+_invalid_key_chars = re.compile(r"\W")
+_numeric_value_keys = ("int64Value", "doubleValue", "boolValue")
+
+
+def _quote(value):
+    value = unicode(value).replace("\\", "\\\\").replace('"', '\\"')
+    return u'"{}"'.format(value)
+
+
+def _kv_key(key):
+    return _invalid_key_chars.sub("_", key)
+
+
+def _point_value(point):
+    """
+    :return: (value key, value) of a v2beta2 or v3 point, for instance
+    ("int64Value", "10")
+    """
+
+    if isinstance(point.get("value"), dict):
+        # v3 point
+        point = point["value"]
+
+    for key, value in point.iteritems():
+        if key.endswith("Value"):
+            return key, value
+    return None, None
+
+
+def _point_interval(point):
+    """
+    :return: (start, end) of a v2beta2 or v3 point
+    """
+
+    if "interval" in point:
+        interval = point["interval"]
+        return interval.get("startTime", ""), interval.get("endTime", "")
+    return point.get("start", ""), point.get("end", "")
+
+
+def _series_pairs(series):
+    """
+    :return: key=value pairs describing a v2beta2 or v3 timeseries
+    """
+
+    if "timeseriesDesc" in series:
+        desc = series["timeseriesDesc"] or {}
+        pairs = [u"metric={}".format(_quote(desc.get("metric", ""))),
+                 u"project={}".format(_quote(desc.get("project", "")))]
+        labels, resource_labels = desc.get("labels"), None
+    else:
+        metric = series.get("metric") or {}
+        resource = series.get("resource") or {}
+        pairs = [u"metric={}".format(_quote(metric.get("type", ""))),
+                 u"resource={}".format(_quote(resource.get("type", "")))]
+        labels, resource_labels = metric.get("labels"), resource.get("labels")
+
+    for key, value in sorted((labels or {}).iteritems()):
+        pairs.append(u"label_{}={}".format(_kv_key(key), _quote(value)))
+    for key, value in sorted((resource_labels or {}).iteritems()):
+        pairs.append(u"resource_label_{}={}".format(
+            _kv_key(key), _quote(value)))
+    return pairs
+
+
+class GoogleCloudMonitorEventFormatter(object):
+    """
+    Turn a page of timeseries into events.
+    timeseries: one JSON event for each timeseries, the way it is returned
+    point: one JSON event for each point, with the other fields of its
+    timeseries
+    kv: one key=value event for each point, labels become label_xxx keys
+    Events of the point and kv formats carry the end of the point as event
+    time. The fields of a timeseries are serialized once for all its
+    points. Both v2beta2 and v3 timeseries are supported.
+    """
+
+    def __init__(self, event_format=timeseries_format):
+        assert event_format in (timeseries_format, point_format, kv_format)
+        self._event_format = event_format
+        self._time_parser = gtp.UTCTimeParser()
+
+    def format(self, timeseries):
+        """
+        :timeseries: a list of timeseries
+        :return: (events, times), times is None when events carry no time,
+        otherwise a list of epoch seconds, one for each event
+        """
+
+        if self._event_format == timeseries_format:
+            return timeseries, None
+
+        if self._event_format == point_format:
+            format_series = self._format_points
+        else:
+            format_series = self._format_kv_points
+
+        events, ends = [], []
+        for series in timeseries:
+            points = series.get("points") or ()
+            if not points:
+                continue
+
+            events.extend(format_series(series, points))
+            ends.extend(_point_interval(point)[1] for point in points)
+        return events, self._time_parser.parse(ends)
+
+    @staticmethod
+    def _format_points(series, points):
+        header = json.dumps(
+            dict((key, value) for key, value in series.iteritems()
+                 if key != "points"))
+        if header == "{}":
+            prefix = '{"point": '
+        else:
+            prefix = header[:-1] + ', "point": '
+        return ["".join((prefix, json.dumps(point), "}"))
+                for point in points]
+
+    @staticmethod
+    def _format_kv_points(series, points):
+        prefix = u" ".join(_series_pairs(series))
+
+        events = []
+        for point in points:
+            value_key, value = _point_value(point)
+            if value_key in _numeric_value_keys:
+                value = unicode(value)
+            elif isinstance(value, dict):
+                value = _quote(json.dumps(value))
+            else:
+                value = _quote(value)
+            start, end = _point_interval(point)
+            events.append(u"{} start={} end={} value_type={} value={}".format(
+                prefix, _quote(start), _quote(end), value_key, value))
+        return events
@@ -0,0 +1,55 @@
+import sys
+import unittest as ut
+from datetime import datetime
+
+sys.path.append("../")
+
+import cloud_monitor_mod.google_cloud_monitor_data_loader as gmdl
+
+
+class _Store(object):
+
+    def oldest(self):
+        return "2016-01-01T00:01:00"
+
+    def win(self):
+        return None
+
+
+class TestAlignedWindows(ut.TestCase):
+
+    def _create_loader(self, config):
+        loader = gmdl.GoogleCloudMonitorDataLoader.__new__(
+            gmdl.GoogleCloudMonitorDataLoader)
+        loader._config = dict(config, polling_interval=60)
+        loader._store = _Store()
+        return loader
+
+    def testWindowsEndOnPeriodBoundaries(self):
+        loader = self._create_loader({
+            "cm_win": 1000, "alignment_period": 600, "reducer": "mean"})
+        windows = loader._get_windows(datetime(2016, 1, 1, 0, 47, 30))
+        self.assertEqual(windows, [
+            ("2016-01-01T00:01:00-00:00", "2016-01-01T00:10:00-00:00"),
+            ("2016-01-01T00:10:00-00:00", "2016-01-01T00:20:00-00:00"),
+            ("2016-01-01T00:20:00-00:00", "2016-01-01T00:30:00-00:00"),
+            ("2016-01-01T00:30:00-00:00", "2016-01-01T00:40:00-00:00"),
+        ])
+
+    def testNoWindowBeforePeriodEnds(self):
+        loader = self._create_loader({
+            "cm_win": 3600, "alignment_period": 600, "reducer": "mean"})
+        self.assertEqual(
+            loader._get_window("2016-01-01T00:10:00",
+                               datetime(2016, 1, 1, 0, 19, 59)),
+            (None, True))
+
+    def testUnalignedWindowsEndAtNow(self):
+        loader = self._create_loader({"cm_win": 3600})
+        self.assertEqual(
+            loader._get_windows(datetime(2016, 1, 1, 0, 47, 30)),
+            [("2016-01-01T00:01:00-00:00", "2016-01-01T00:47:30-00:00")])
+
+
+if __name__ == "__main__":
+    ut.main()
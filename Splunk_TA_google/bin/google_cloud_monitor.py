@@ -16,6 +16,7 @@ import splunktalib.data_loader_mgr as dlm
 import google_ta_common.ta_common as tacommon
 import cloud_monitor_mod.google_cloud_monitor_conf as mconf
 import cloud_monitor_mod.google_cloud_monitor_data_loader as gmdl
+import cloud_monitor_mod.google_cloud_monitor_descriptors as gmd
 
 
 utils.remove_http_proxy_env_vars()
@@ -28,6 +29,14 @@ def print_scheme():
     tacommon.print_scheme(title, description)
 
 
+def get_metric_change_handler(loader_mgr):
+    def reload_and_exit(changed_metrics):
+        logger.info("Metric(s)=%s changed, exiting...", changed_metrics)
+        loader_mgr.tear_down()
+
+    return reload_and_exit
+
+
 @gcp.catch_all(logger)
 def run():
     """
@@ -49,7 +58,19 @@ def run():
         conf_change_handler, [gmc.myta_data_collection_conf])
     loader_mgr.add_timer(conf_monitor, time.time(), 10)
 
-    jobs = [gmdl.GoogleCloudMonitorDataLoader(task) for task in tasks]
+    # Metric patterns are expanded against the cached metric descriptors,
+    # reload when the refreshed descriptors match other metrics
+    expanded_tasks = gmd.expand_wildcard_metrics(tasks)
+    if not expanded_tasks:
+        return
+
+    metric_change_handler = gmd.get_metric_change_handler(
+        tasks, expanded_tasks, get_metric_change_handler(loader_mgr))
+    loader_mgr.add_timer(metric_change_handler, time.time() + 3600, 3600)
+
+    tasks = expanded_tasks
+
+    jobs = gmdl.create_data_loaders(tasks)
     loader_mgr.start(jobs)
     logger.info("End google_cloud_monitor")
 
@@ -0,0 +1,68 @@
+import calendar
+
+
+class UTCTimeParser(object):
+    """
+    Parse RFC3339 UTC times, for instance publishTime of Pub/Sub messages
+    or end of Cloud Monitor points like 2016-02-24T05:19:38.509Z, to epoch
+    seconds. Times of a batch mostly fall within the same few seconds, so
+    the epoch of the second prefix is cached and only the fraction is
+    parsed per time.
+    """
+
+    def __init__(self, max_cache_size=4096):
+        self._max_cache_size = max_cache_size
+        self._cache = {}
+
+    def parse(self, utc_times):
+        """
+        :param utc_times: list of RFC3339 UTC time strings
+        :return: list of epoch seconds as float, None for the ones which
+        can't be parsed
+        """
+
+        cache = self._cache
+        epochs = []
+        for utc_time in utc_times:
+            if not utc_time or utc_time[-1] not in "Zz":
+                epochs.append(None)
+                continue
+
+            prefix = utc_time[:19]
+            seconds = cache.get(prefix)
+            if seconds is None:
+                seconds = self._parse_prefix(prefix)
+                if seconds is None:
+                    epochs.append(None)
+                    continue
+
+                if len(cache) >= self._max_cache_size:
+                    cache.clear()
+                cache[prefix] = seconds
+
+            fraction = utc_time[19:-1]
+            if fraction:
+                try:
+                    epochs.append(seconds + float(fraction))
+                except ValueError:
+                    epochs.append(None)
+            else:
+                epochs.append(float(seconds))
+        return epochs
+
+    @staticmethod
+    def _parse_prefix(prefix):
+        """
+        :param prefix: 2016-02-24T05:19:38
+        """
+
+        if len(prefix) != 19 or prefix[10] not in "Tt":
+            return None
+
+        try:
+            return calendar.timegm(
+                (int(prefix[0:4]), int(prefix[5:7]), int(prefix[8:10]),
+                 int(prefix[11:13]), int(prefix[14:16]), int(prefix[17:19]),
+                 0, 0, 0))
+        except ValueError:
+            return None
@@ -0,0 +1,146 @@
+import hashlib
+import json
+import threading
+import time
+
+from googleapiclient import discovery
+
+import splunktalib.rest as sr
+import google_wrapper.common as gwc
+
+
+_proxy_keys = ("proxy_url", "proxy_port", "proxy_username", "proxy_password",
+               "proxy_rdns", "proxy_type")
+
+
+def credential_key(config):
+    """
+    :return: a hashable key of the credential and scopes in config
+    """
+
+    creds = config.get("google_credentials")
+    if creds:
+        if not isinstance(creds, basestring):
+            creds = json.dumps(creds, sort_keys=True)
+        if isinstance(creds, unicode):
+            creds = creds.encode("utf-8")
+        digest = hashlib.sha1(creds).hexdigest()
+    else:
+        digest = "application_default"
+    return (digest, tuple(config.get("scopes") or ()))
+
+
+def client_key(config):
+    """
+    :return: a hashable key of everything a Google client is built from
+    """
+
+    return (credential_key(config), config["service_name"],
+            config["version"], config.get("pulling_interval", 30),
+            tuple(config.get(key) for key in _proxy_keys))
+
+
+class GoogleClientRegistry(object):
+    """
+    Share Google API clients in the process. Clients are keyed by
+    credential, service, version and proxy settings. A client wraps an
+    httplib2 connection which is not thread safe, so it is leased to one
+    user at a time by acquire and handed back by release, clients idle
+    for more than max_idle seconds are dropped. Credentials are shared by
+    all clients of the same key, so an OAuth token is fetched once and
+    reused until it expires.
+    """
+
+    def __init__(self, max_idle=300):
+        self._max_idle = max_idle
+        self._lock = threading.Lock()
+        # credential key -> credentials
+        self._credentials = {}
+        # client key -> list of (client, release time)
+        self._idle_clients = {}
+        # id(client) -> client key
+        self._leased_clients = {}
+
+    def get_credentials(self, config):
+        """
+        :param config: same as google_wrapper.common.get_credentials
+        """
+
+        key = credential_key(config)
+        with self._lock:
+            credentials = self._credentials.get(key)
+        if credentials is not None:
+            return credentials
+
+        credentials = gwc.get_credentials(config)
+        with self._lock:
+            return self._credentials.setdefault(key, credentials)
+
+    def acquire(self, config):
+        """
+        :param config: same as google_wrapper.common.create_google_client
+        :return: a Google client which is only used by the caller until it
+        is released
+        """
+
+        key = client_key(config)
+        with self._lock:
+            self._evict_idle_clients_with_lock(time.time())
+            idle_clients = self._idle_clients.get(key)
+            if idle_clients:
+                client, _ = idle_clients.pop()
+                self._leased_clients[id(client)] = key
+                return client
+
+        http = sr.build_http_connection(
+            config, timeout=config.get("pulling_interval", 30))
+        client = discovery.build(
+            config["service_name"], config["version"], http=http,
+            credentials=self.get_credentials(config))
+        with self._lock:
+            self._leased_clients[id(client)] = key
+        return client
+
+    def release(self, client):
+        with self._lock:
+            key = self._leased_clients.pop(id(client), None)
+            if key is None:
+                return
+
+            now = time.time()
+            self._idle_clients.setdefault(key, []).append((client, now))
+            self._evict_idle_clients_with_lock(now)
+
+    def stats(self):
+        with self._lock:
+            return {
+                "credentials": len(self._credentials),
+                "idle_clients": sum(
+                    len(clients) for clients in self._idle_clients.values()),
+                "leased_clients": len(self._leased_clients),
+            }
+
+    def _evict_idle_clients_with_lock(self, now):
+        for key, idle_clients in self._idle_clients.items():
+            idle_clients[:] = [
+                (client, released) for client, released in idle_clients
+                if now - released < self._max_idle]
+            if not idle_clients:
+                del self._idle_clients[key]
+
+
+_client_registry = None
+_client_registry_lock = threading.Lock()
+
+
+def get_client_registry():
+    """
+    :return: the GoogleClientRegistry shared in the current process
+    """
+
+    global _client_registry
+
+    with _client_registry_lock:
+        if _client_registry is None:
+            _client_registry = GoogleClientRegistry()
+        return _client_registry
@@ -0,0 +1,340 @@
+import traceback
+
+from googleapiclient import discovery
+
+import google_wrapper.client_registry as gcr
+import google_wrapper.cloud_monitor_wrapper as gmw
+
+
+ALIGNERS = {
+    "max": "ALIGN_MAX",
+    "min": "ALIGN_MIN",
+    "sum": "ALIGN_SUM",
+    "mean": "ALIGN_MEAN",
+}
+
+
+def to_rfc3339(metric_date):
+    """
+    :metric_date: 2016-01-16T00:00:00-00:00
+    return: 2016-01-16T00:00:00Z
+    """
+
+    if metric_date.endswith("-00:00"):
+        metric_date = metric_date[:-len("-00:00")]
+    if not metric_date.endswith("Z"):
+        metric_date = "{}Z".format(metric_date)
+    return metric_date
+
+
+class GoogleCloudMonitorV3(object):
+    """
+    GoogleCloudMonitor on the monitoring v3 timeSeries API. Metrics are
+    selected by filter, pages are up to page_size points and points can be
+    aligned by the API. It yields v3 timeseries, which carry metric,
+    resource and points with interval and value.
+    """
+
+    def __init__(self, logger, config, http=None):
+        """
+        :param: config
+        {
+            "proxy_url": xxx,
+            "proxy_port": xxx,
+            "proxy_username": xxx,
+            "proxy_password": xxx,
+            "proxy_rdns": xxx,
+            "proxy_type": xxx,
+            "google_credentials": xxx,
+        }
+        :param http: httplib2.Http like object, when it is set the client is
+        built on it without credentials instead of being leased from the
+        client registry, for instance HttpMockSequence
+        """
+
+        self._config = config
+        self._config["scopes"] = gmw.MONITOR_SCOPES
+        self._config["service_name"] = "monitoring"
+        self._config["version"] = "v3"
+        self._logger = logger
+        self._leased = http is None
+        if http is None:
+            self._client = gcr.get_client_registry().acquire(self._config)
+        else:
+            self._client = discovery.build(
+                "monitoring", "v3", http=http, cache_discovery=False)
+
+    def close(self):
+        """
+        Hand the client back to the process wide client registry
+        """
+
+        if self._client is not None and self._leased:
+            gcr.get_client_registry().release(self._client)
+        self._client = None
+
+    def list_metrics(self, params):
+        """
+        :params: dict like object
+        {
+        "google_project": xxx,
+        "google_metric": xxx,
+        "oldest": "2016-01-16T00:00:00-00:00",
+        "youngest": "2016-02-16T00:00:00-00:00",
+        "metric_filter": 'resource.label.zone = "us-central1-a"',
+        "page_size": 1000,
+        "alignment_period": 300,
+        "reducer": "mean",
+        ...
+        }
+        metric_filter, page_size, alignment_period and reducer are optional.
+        metric_filter is ANDed with the metric type filter. When
+        alignment_period and reducer are both set, the points of each
+        timeseries are aligned by the API to alignment_period seconds with
+        reducer, one of max, min, sum and mean
+        return: a list of timeseries
+        """
+
+        all_results = []
+        for page in self.iter_metrics(params):
+            all_results.extend(page)
+        return all_results
+
+    def iter_metrics(self, params):
+        """
+        :params: same as list_metrics
+        return: a generator which yields timeseries page by page
+        """
+
+        try:
+            timeseries = self._client.projects().timeSeries()
+            req = timeseries.list(**self._get_list_params(params))
+            for page in gmw.iter_pagination_results(
+                    timeseries, req, "timeSeries"):
+                yield page
+        except Exception:
+            self._logger.error(
+                "Failed to list Google metric for project=%s, metric=%s, "
+                "error=%s", params["google_project"],
+                params["google_metric"], traceback.format_exc())
+            raise
+
+    @staticmethod
+    def _get_list_params(params):
+        metric_filter = 'metric.type = "{}"'.format(params["google_metric"])
+        if params.get("metric_filter"):
+            metric_filter = "{} AND ({})".format(
+                metric_filter, params["metric_filter"])
+
+        list_params = {
+            "name": "projects/{}".format(params["google_project"]),
+            "filter": metric_filter,
+            "interval_startTime": to_rfc3339(params["oldest"]),
+            "interval_endTime": to_rfc3339(params["youngest"]),
+            "pageSize": int(params.get("page_size") or 1000),
+        }
+
+        if params.get("alignment_period") and params.get("reducer"):
+            list_params["aggregation_alignmentPeriod"] = "{}s".format(
+                params["alignment_period"])
+            list_params["aggregation_perSeriesAligner"] = ALIGNERS[
+                params["reducer"]]
+        return list_params
+
+    def write_metrics(self, metrics):
+        pass
+
+    def metirc_descriptors(self, project_name):
+        """
+        return a list of metric_descriptor
+        {
+        "name": "projects/xxx/metricDescriptors/pubsub.googleapis.com/...",
+        "type": "pubsub.googleapis.com/subscription/pull_request_count",
+        "labels": [
+            {
+                 "key": "subscription_id"
+            }
+        ],
+        "metricKind": "DELTA",
+        "valueType": "INT64",
+        "description": "Cumulative count of pull requests.",
+        }
+        """
+
+        try:
+            descriptors = self._client.projects().metricDescriptors()
+            req = descriptors.list(name="projects/{}".format(project_name))
+            return gmw.get_pagination_results(
+                descriptors, req, "metricDescriptors")
+        except Exception:
+            self._logger.error("Failed to list Google metric descriptors for "
+                               "project=%s, error=%s",
+                               project_name, traceback.format_exc())
+            raise
+
+
+if __name__ == "__main__":
+    # Self-check against recorded responses, run from the bin directory:
+    # python -m google_wrapper.cloud_monitor_v3_wrapper
+    import json
+    import logging
+    import urlparse
+
+    from googleapiclient.http import HttpMockSequence
+
+    # Minimal monitoring v3 discovery document, only for this self-check
+    discovery_doc = """{
+     "kind": "discovery#restDescription",
+     "discoveryVersion": "v1",
+     "id": "monitoring:v3",
+     "name": "monitoring",
+     "version": "v3",
+     "rootUrl": "https://monitoring.googleapis.com/",
+     "servicePath": "",
+     "baseUrl": "https://monitoring.googleapis.com/",
+     "batchPath": "batch",
+     "protocol": "rest",
+     "parameters": {},
+     "schemas": {
+      "ListTimeSeriesResponse": {
+       "id": "ListTimeSeriesResponse",
+       "type": "object",
+       "properties": {
+        "timeSeries": {"type": "array", "items": {"type": "object"}},
+        "nextPageToken": {"type": "string"}
+       }
+      },
+      "ListMetricDescriptorsResponse": {
+       "id": "ListMetricDescriptorsResponse",
+       "type": "object",
+       "properties": {
+        "metricDescriptors": {"type": "array", "items": {"type": "object"}},
+        "nextPageToken": {"type": "string"}
+       }
+      }
+     },
+     "resources": {
+      "projects": {
+       "resources": {
+        "timeSeries": {
+         "methods": {
+          "list": {
+           "id": "monitoring.projects.timeSeries.list",
+           "path": "v3/{+name}/timeSeries",
+           "httpMethod": "GET",
+           "parameters": {
+            "name": {"type": "string", "required": true, "location": "path",
+                     "pattern": "^projects/[^/]+$"},
+            "filter": {"type": "string", "location": "query"},
+            "interval.startTime": {"type": "string", "location": "query"},
+            "interval.endTime": {"type": "string", "location": "query"},
+            "aggregation.alignmentPeriod": {"type": "string",
+                                            "location": "query"},
+            "aggregation.perSeriesAligner": {"type": "string",
+                                             "location": "query"},
+            "pageSize": {"type": "integer", "format": "int32",
+                         "location": "query"},
+            "pageToken": {"type": "string", "location": "query"}
+           },
+           "parameterOrder": ["name"],
+           "response": {"$ref": "ListTimeSeriesResponse"}
+          }
+         }
+        },
+        "metricDescriptors": {
+         "methods": {
+          "list": {
+           "id": "monitoring.projects.metricDescriptors.list",
+           "path": "v3/{+name}/metricDescriptors",
+           "httpMethod": "GET",
+           "parameters": {
+            "name": {"type": "string", "required": true, "location": "path",
+                     "pattern": "^projects/[^/]+$"},
+            "pageToken": {"type": "string", "location": "query"}
+           },
+           "parameterOrder": ["name"],
+           "response": {"$ref": "ListMetricDescriptorsResponse"}
+          }
+         }
+        }
+       }
+      }
+     }
+    }"""
+
+    class RecordingHttpMockSequence(HttpMockSequence):
+
+        def __init__(self, iterable):
+            HttpMockSequence.__init__(self, iterable)
+            self.uris = []
+
+        def request(self, uri, *args, **kwargs):
+            self.uris.append(uri)
+            return HttpMockSequence.request(self, uri, *args, **kwargs)
+
+    logger = logging.getLogger("google")
+    logger.addHandler(logging.NullHandler())
+
+    metric = "pubsub.googleapis.com/subscription/pull_request_count"
+    series = {
+        "metric": {"type": metric, "labels": {}},
+        "resource": {"type": "pubsub_subscription",
+                     "labels": {"subscription_id": "sub"}},
+        "metricKind": "DELTA",
+        "valueType": "INT64",
+        "points": [{
+            "interval": {"startTime": "2016-01-16T00:00:00Z",
+                         "endTime": "2016-01-16T00:05:00Z"},
+            "value": {"int64Value": "3"},
+        }],
+    }
+    ok = {"status": "200"}
+    http = RecordingHttpMockSequence([
+        (ok, discovery_doc),
+        (ok, json.dumps({"timeSeries": [series], "nextPageToken": "t1"})),
+        (ok, json.dumps({"timeSeries": [series, series]})),
+        (ok, json.dumps({"metricDescriptors": [{"type": metric}]})),
+        ({"status": "400"}, json.dumps({"error": {"code": 400}})),
+    ])
+
+    params = {
+        "google_project": "proj",
+        "google_metric": metric,
+        "oldest": "2016-01-16T00:00:00-00:00",
+        "youngest": "2016-01-16T01:00:00-00:00",
+        "metric_filter": 'resource.label.subscription_id = "sub"',
+        "page_size": 5000,
+        "alignment_period": 300,
+        "reducer": "sum",
+    }
+    mon = GoogleCloudMonitorV3(logger, {}, http=http)
+
+    pages = list(mon.iter_metrics(params))
+    assert [len(page) for page in pages] == [1, 2], pages
+
+    query = urlparse.parse_qs(urlparse.urlparse(http.uris[1]).query)
+    assert http.uris[1].startswith(
+        "https://monitoring.googleapis.com/v3/projects/proj/timeSeries?")
+    assert query["filter"] == [
+        'metric.type = "{}" AND (resource.label.subscription_id = "sub")'
+        .format(metric)], query
+    assert query["interval.startTime"] == ["2016-01-16T00:00:00Z"], query
+    assert query["interval.endTime"] == ["2016-01-16T01:00:00Z"], query
+    assert query["pageSize"] == ["5000"], query
+    assert query["aggregation.alignmentPeriod"] == ["300s"], query
+    assert query["aggregation.perSeriesAligner"] == ["ALIGN_SUM"], query
+    query = urlparse.parse_qs(urlparse.urlparse(http.uris[2]).query)
+    assert query["pageToken"] == ["t1"], query
+
+    descriptors = mon.metirc_descriptors("proj")
+    assert descriptors == [{"type": metric}], descriptors
+
+    try:
+        mon.list_metrics(params)
+    except Exception as e:
+        assert getattr(e, "resp", {}).get("status") == "400", e
+    else:
+        assert 0, "HTTP 400 is not raised"
+
+    mon.close()
+    print "GoogleCloudMonitorV3 self-check passed"
@@ -1,22 +1,39 @@
+import collections
+import json
+import math
 import traceback
+import time
 
-import google_wrapper.common as gwc
+from googleapiclient.errors import HttpError
+
+import google_wrapper.client_registry as gcr
+import google_ta_common.google_time_parser as gtp
 
 
 MONITOR_SCOPES = ["https://www.googleapis.com/auth/monitoring",
                   "https://www.googleapis.com/auth/cloud-platform"]
 
+REDUCERS = {
+    "max": max,
+    "min": min,
+    "sum": sum,
+    "mean": lambda values: float(sum(values)) / len(values),
+}
+
+
+def iter_pagination_results(service, req, key):
+    """
+    Yield the results of req page by page, each page is a list
+    """
 
-def get_pagination_results(service, req, key):
-    all_results = []
     if req is None:
-        return all_results
+        return
 
     result = req.execute(num_retries=3)
     if result and result.get(key):
-        all_results.extend(result[key])
+        yield result[key]
 
-    if "nextPageToken" in result:
+    if result and "nextPageToken" in result:
         while 1:
             req = service.list_next(req, result)
             if not req:
@@ -24,13 +41,119 @@ def get_pagination_results(service, req, key):
 
             result = req.execute(num_retries=3)
             if result and result.get(key):
-                all_results.extend(result[key])
+                yield result[key]
             else:
                 break
 
+
+def _strf_point_date(epoch):
+    return time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime(epoch))
+
+
+class TimeseriesAggregator(object):
+    """
+    Align the points of timeseries to alignment_period seconds and combine
+    the points of a period with reducer, the way the API does with window
+    and aggregator. The API splits a timeseries across pages, so the points
+    of all pages of a window are added before the aggregated timeseries are
+    taken. Points which are not int64 or double are left as they are.
+    """
+
+    def __init__(self, alignment_period, reducer, time_parser=None):
+        """
+        :reducer: one of REDUCERS
+        """
+
+        self._reduce_values = REDUCERS[reducer]
+        self._reducer = reducer
+        self._period = int(alignment_period)
+        self._time_parser = time_parser or gtp.UTCTimeParser()
+        # timeseriesDesc key -> [series, {period start: values}, others,
+        # value key], in the order the timeseries come
+        self._series = collections.OrderedDict()
+
+    def add(self, timeseries):
+        """
+        :param timeseries: a page of timeseries
+        """
+
+        period = self._period
+        for series in timeseries:
+            key = json.dumps(series.get("timeseriesDesc"), sort_keys=True)
+            state = self._series.get(key)
+            if state is None:
+                state = self._series[key] = [series, {}, [], None]
+            buckets, others = state[1], state[2]
+
+            points = series.get("points") or ()
+            ends = self._time_parser.parse(
+                [point.get("end") for point in points])
+            for point, end in zip(points, ends):
+                if end is None:
+                    others.append(point)
+                    continue
+
+                if "doubleValue" in point:
+                    state[3] = "doubleValue"
+                    value = float(point["doubleValue"])
+                elif "int64Value" in point:
+                    state[3] = state[3] or "int64Value"
+                    value = int(point["int64Value"])
+                else:
+                    others.append(point)
+                    continue
+
+                # A point ending on a period boundary belongs to that
+                # period, a point ending after it, even by a fraction, to
+                # the next one
+                start = (int(math.ceil(end)) - 1) // period * period
+                buckets.setdefault(start, []).append(value)
+
+    def get_timeseries(self):
+        """
+        :return: a list of aggregated timeseries
+        """
+
+        results = []
+        for series, buckets, others, value_key in self._series.itervalues():
+            if self._reducer == "mean":
+                value_key = "doubleValue"
+            aggregated = []
+            for start in sorted(buckets, reverse=True):
+                value = self._reduce_values(buckets[start])
+                if value_key == "int64Value":
+                    value = str(value)
+                aggregated.append({
+                    "start": _strf_point_date(start),
+                    "end": _strf_point_date(start + self._period),
+                    value_key: value,
+                })
+
+            new_series = dict(series)
+            new_series["points"] = aggregated + others
+            results.append(new_series)
+        return results
+
+
+def get_pagination_results(service, req, key):
+    all_results = []
+    for page in iter_pagination_results(service, req, key):
+        all_results.extend(page)
     return all_results
 
 
+def create_cloud_monitor(logger, config):
+    """
+    :return: GoogleCloudMonitorV3 when monitoring_api of config is v3,
+    otherwise GoogleCloudMonitor
+    """
+
+    if config.get("monitoring_api") == "v3":
+        import google_wrapper.cloud_monitor_v3_wrapper as gmw3
+        return gmw3.GoogleCloudMonitorV3(logger, config)
+    return GoogleCloudMonitor(logger, config)
+
+
 class GoogleCloudMonitor(object):
 
     def __init__(self, logger, config):
@@ -52,7 +175,18 @@ class GoogleCloudMonitor(object):
         self._config["service_name"] = "cloudmonitoring"
         self._config["version"] = "v2beta2"
         self._logger = logger
-        self._client = gwc.create_google_client(self._config)
+        self._client = gcr.get_client_registry().acquire(self._config)
+        # metrics the API refused to align
+        self._unaligned_metrics = set()
+
+    def close(self):
+        """
+        Hand the client back to the process wide client registry
+        """
+
+        if self._client is not None:
+            gcr.get_client_registry().release(self._client)
+            self._client = None
 
     def list_metrics(self, params):
         """
@@ -62,18 +196,66 @@ class GoogleCloudMonitor(object):
         "google_metric": xxx,
         "oldest": "2016-01-16T00:00:00-00:00",
         "youngest": "2016-02-16T00:00:00-00:00",
+        "alignment_period": 300,
+        "reducer": "mean",
         ...
         }
-        return:
+        alignment_period and reducer are optional, when both are set points
+        are aligned to alignment_period seconds and combined with reducer,
+        one of max, min, sum and mean
+        return: a list of timeseries
         """
 
+        all_results = []
+        for page in self.iter_metrics(params):
+            all_results.extend(page)
+        return all_results
+
+    def iter_metrics(self, params):
+        """
+        :params: same as list_metrics
+        return: a generator which yields timeseries page by page
+        """
+
+        alignment_period = params.get("alignment_period")
+        reducer = params.get("reducer")
+        aligned = bool(alignment_period and reducer)
         try:
-            timeseries = self._client.timeseries()
-            req = timeseries.list(
-                project=params["google_project"],
-                oldest=params["oldest"], youngest=params["youngest"],
-                metric=params["google_metric"], count=100)
-            return get_pagination_results(timeseries, req, "timeseries")
+            if (aligned and
+                    params["google_metric"] not in self._unaligned_metrics):
+                pages = 0
+                try:
+                    for page in self._iter_timeseries(
+                            params, window="{}s".format(alignment_period),
+                            aggregator=reducer):
+                        pages += 1
+                        yield page
+                    return
+                except HttpError as e:
+                    if e.resp.status != 400 or pages:
+                        raise
+
+                    # The API refuses to align some metric types, the
+                    # rejection comes with the first page
+                    self._logger.warning(
+                        "Failed to align metric=%s of project=%s, aggregate "
+                        "locally, error=%s", params["google_metric"],
+                        params["google_project"], e)
+                    self._unaligned_metrics.add(params["google_metric"])
+
+            if not aligned:
+                for page in self._iter_timeseries(params):
+                    yield page
+                return
+
+            # A period may span pages, only yield it once all are added.
+            # Windows end on period boundaries, so periods don't span them
+            aggregator = TimeseriesAggregator(alignment_period, reducer)
+            for page in self._iter_timeseries(params):
+                aggregator.add(page)
+            timeseries = aggregator.get_timeseries()
+            if timeseries:
+                yield timeseries
         except Exception:
             self._logger.error(
                 "Failed to list Google metric for project=%s, metric=%s, "
@@ -81,6 +263,14 @@ class GoogleCloudMonitor(object):
                 params["google_metric"], traceback.format_exc())
             raise
 
+    def _iter_timeseries(self, params, **kwargs):
+        timeseries = self._client.timeseries()
+        req = timeseries.list(
+            project=params["google_project"],
+            oldest=params["oldest"], youngest=params["youngest"],
+            metric=params["google_metric"], count=100, **kwargs)
+        return iter_pagination_results(timeseries, req, "timeseries")
+
     def write_metrics(self, metrics):
         pass
 
@@ -9,6 +9,27 @@ def fqrn(resource_type, project, resource):
     return "projects/{}/{}/{}".format(project, resource_type, resource)
 
 
+def get_credentials(config):
+    """
+    :param: config
+    {
+        "google_credentials": xxx,
+        "scopes": xxx,
+    }
+    :return: scoped oauth2client credentials
+    """
+
+    if config.get("google_credentials"):
+        credentials = oc.get_application_credential_from_json(
+            config["google_credentials"])
+    else:
+        credentials = oc.GoogleCredentials.get_application_default()
+
+    if credentials.create_scoped_required():
+        credentials = credentials.create_scoped(config["scopes"])
+    return credentials
+
+
 def create_google_client(config):
     """
     :param: config
@@ -28,15 +49,7 @@ def create_google_client(config):
     }
     """
 
-    if config.get("google_credentials"):
-        credentials = oc.get_application_credential_from_json(
-            config["google_credentials"])
-    else:
-        credentials = oc.GoogleCredentials.get_application_default()
-
-    if credentials.create_scoped_required():
-        credentials = credentials.create_scoped(config["scopes"])
-
+    credentials = get_credentials(config)
     http = sr.build_http_connection(
         config, timeout=config.get("pulling_interval", 30))
     client = discovery.build(
@@ -0,0 +1,141 @@
+import threading
+import Queue
+import traceback
+import time
+
+import google_wrapper.pubsub_wrapper as gpw
+
+
+class GooglePubSubPublisher(object):
+    """
+    Publish messages to a topic in batches. A batch is sent when it holds
+    max_messages messages or max_bytes bytes, or when its oldest message
+    has waited max_latency seconds. Up to max_in_flight publish requests
+    are sent concurrently, each sender owns its Google client. publish
+    blocks when all senders are busy and max_in_flight batches are queued.
+    """
+
+    def __init__(self, logger, config, max_messages=1000,
+                 max_bytes=8 * 1024 * 1024, max_latency=0.05,
+                 max_in_flight=4):
+        """
+        :param config: GooglePubSub config which contains google_topic
+        """
+
+        self._logger = logger
+        self._config = config
+        self._max_messages = max(int(max_messages), 1)
+        self._max_bytes = int(max_bytes)
+        self._max_latency = float(max_latency)
+        self._send_queue = Queue.Queue(max(int(max_in_flight), 1))
+        self._senders = []
+        for i in xrange(max(int(max_in_flight), 1)):
+            thr = threading.Thread(
+                target=self._do_send, name="publisher_{}".format(i))
+            thr.daemon = True
+            self._senders.append(thr)
+        self._flusher = threading.Thread(target=self._do_flush)
+        self._flusher.daemon = True
+
+        self._lock = threading.Lock()
+        self._batch = []
+        self._batch_bytes = 0
+        self._batch_start = 0
+        self._stats_lock = threading.Lock()
+        self.published = 0
+        self.failed = 0
+        self._started = False
+        self._stopped = False
+
+    def start(self):
+        if self._started:
+            return
+        self._started = True
+
+        for thr in self._senders:
+            thr.start()
+        self._flusher.start()
+
+    def tear_down(self):
+        """
+        Send the pending batch, wait for in flight batches and stop
+        """
+
+        if not self._started:
+            return
+        self._started = False
+
+        self.flush()
+        self._stopped = True
+        self._flusher.join()
+        for _ in self._senders:
+            self._send_queue.put(None)
+        for thr in self._senders:
+            thr.join()
+
+    def publish(self, message):
+        """
+        :param message: str, it will be base64 encoded
+        """
+
+        batch = None
+        with self._lock:
+            if not self._batch:
+                self._batch_start = time.time()
+            self._batch.append(message)
+            self._batch_bytes += len(message)
+            if (len(self._batch) >= self._max_messages or
+                    self._batch_bytes >= self._max_bytes):
+                batch = self._take_batch()
+
+        if batch:
+            self._send_queue.put(batch)
+
+    def flush(self):
+        with self._lock:
+            batch = self._take_batch()
+
+        if batch:
+            self._send_queue.put(batch)
+
+    def _take_batch(self):
+        batch, self._batch, self._batch_bytes = self._batch, [], 0
+        return batch
+
+    def _do_flush(self):
+        interval = max(self._max_latency / 2, 0.001)
+        while not self._stopped:
+            time.sleep(interval)
+            with self._lock:
+                if (not self._batch or
+                        time.time() - self._batch_start < self._max_latency):
+                    continue
+                batch = self._take_batch()
+            self._send_queue.put(batch)
+
+    def _do_send(self):
+        pub = gpw.GooglePubSub(self._logger, self._config)
+        while 1:
+            batch = self._send_queue.get()
+            if batch is None:
+                break
+
+            for _ in range(3):
+                try:
+                    pub.publish_messages(batch)
+                except Exception:
+                    self._logger.error(
+                        "Failed to publish %d messages to project=%s, "
+                        "topic=%s, error=%s", len(batch),
+                        self._config["google_project"],
+                        self._config["google_topic"], traceback.format_exc())
+                    time.sleep(1)
+                else:
+                    self._count("published", len(batch))
+                    break
+            else:
+                self._count("failed", len(batch))
+
+    def _count(self, name, count):
+        with self._stats_lock:
+            setattr(self, name, getattr(self, name) + count)
@@ -0,0 +1,131 @@
+import json
+import socket
+import ssl
+
+import splunktalib.rest as sr
+import google_wrapper.client_registry as gcr
+
+
+PUBSUB_ENDPOINT = "https://pubsub.googleapis.com"
+
+
+def is_timeout(e):
+    if isinstance(e, socket.timeout):
+        return True
+    return isinstance(e, ssl.SSLError) and "timed out" in str(e)
+
+
+class GooglePubSubHttpTransport(object):
+    """
+    Talk to the Pub/Sub v1 REST API over one long lived keep-alive
+    connection. Requests are composed directly instead of going through the
+    discovery client, and the OAuth token is reused until it expires. When
+    pubsub_endpoint is configured, for instance a local fake Pub/Sub server
+    or the Pub/Sub emulator, requests are sent there without credentials.
+    """
+
+    def __init__(self, config):
+        """
+        :param: config
+        {
+            "proxy_url": xxx,
+            "proxy_port": xxx,
+            "proxy_username": xxx,
+            "proxy_password": xxx,
+            "proxy_rdns": xxx,
+            "proxy_type": xxx,
+            "google_credentials": xxx,
+            "scopes": xxx,
+            "pubsub_endpoint": xxx,
+            "pulling_interval": xxx,
+        }
+        """
+
+        endpoint = config.get("pubsub_endpoint")
+        self._endpoint = (endpoint or PUBSUB_ENDPOINT).rstrip("/")
+        self._credentials = None
+        if not endpoint:
+            # Share the credentials and so the OAuth token in the process
+            self._credentials = gcr.get_client_registry().get_credentials(
+                config)
+
+        self._http = sr.build_http_connection(
+            config, timeout=config.get("pulling_interval", 30))
+        self._headers = {
+            "Content-Type": "application/json",
+            "Connection": "keep-alive",
+        }
+        self._token = None
+
+    def pull(self, subscription, max_messages):
+        """
+        :return: a list of received messages, empty list when the pull
+        times out or there is no message
+        """
+
+        body = {
+            "returnImmediately": False,
+            "maxMessages": int(max_messages),
+        }
+        try:
+            resp = self._post(subscription, "pull", body)
+        except Exception as e:
+            if is_timeout(e):
+                return []
+            raise
+        return resp.get("receivedMessages") or []
+
+    def acknowledge(self, subscription, ack_ids):
+        self._post(subscription, "acknowledge", {"ackIds": ack_ids})
+
+    def modify_ack_deadline(self, subscription, ack_ids, ack_deadline_seconds):
+        body = {
+            "ackIds": ack_ids,
+            "ackDeadlineSeconds": int(ack_deadline_seconds),
+        }
+        self._post(subscription, "modifyAckDeadline", body)
+
+    def get_subscription(self, subscription):
+        return self._request("GET", "{endpoint}/v1/{resource}".format(
+            endpoint=self._endpoint, resource=subscription))
+
+    def publish(self, topic, messages):
+        """
+        :param messages: list of {"data": base64 encoded data}
+        :return: {"messageIds": [...]}
+        """
+
+        return self._post(topic, "publish", {"messages": messages})
+
+    def _post(self, resource, method, body):
+        uri = "{endpoint}/v1/{resource}:{method}".format(
+            endpoint=self._endpoint, resource=resource, method=method)
+        return self._request("POST", uri, json.dumps(body))
+
+    def _request(self, method, uri, body=None):
+        response, content = self._http.request(
+            uri, method=method, headers=self._get_headers(), body=body)
+        if response.status == 401 and self._credentials is not None:
+            self._credentials.refresh(self._http)
+            response, content = self._http.request(
+                uri, method=method, headers=self._get_headers(), body=body)
+
+        if response.status not in (200, 201):
+            raise Exception(
+                "Failed to {} uri={}, error_code={}, reason={}".format(
+                    method, uri, response.status, content))
+
+        if not content:
+            return {}
+        return json.loads(content)
+
+    def _get_headers(self):
+        if self._credentials is None:
+            return self._headers
+
+        token = self._credentials.get_access_token(self._http).access_token
+        if token != self._token:
+            self._token = token
+            self._headers = dict(self._headers)
+            self._headers["Authorization"] = "Bearer {}".format(token)
+        return self._headers
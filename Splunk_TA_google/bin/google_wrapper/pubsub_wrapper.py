@@ -1,9 +1,10 @@
 import traceback
 import time
 import base64
-import ssl
+import binascii
 
 import google_wrapper.common as gwc
+import google_wrapper.pubsub_transport as gpt
 
 
 PUBSUB_SCOPES = ["https://www.googleapis.com/auth/pubsub"]
@@ -19,6 +20,26 @@ def get_full_topic_name(project, topic):
     return gwc.fqrn('topics', project, topic)
 
 
+def decode_messages(logger, messages):
+    """
+    Base64 decode the data of received messages in place. Messages with
+    invalid base64 data are left as they are
+    """
+
+    a2b = binascii.a2b_base64
+    for message in messages:
+        msg = message.get("message")
+        if not msg:
+            continue
+
+        data = msg.get("data")
+        if data:
+            try:
+                msg["data"] = a2b(data)
+            except (binascii.Error, TypeError, UnicodeEncodeError):
+                logger.error("Invalid base64 event=%s", data)
+
+
 class GooglePubSub(object):
 
     def __init__(self, logger, config):
@@ -37,7 +58,12 @@ class GooglePubSub(object):
             "google_topic": xxx,
             "batch_size": xxx,
             "base64encoded": True/False,
+            "pubsub_transport": rest/persistent,
+            "pubsub_endpoint": xxx,
         }
+        pubsub_transport "persistent" pulls, acks and publishes over
+        GooglePubSubHttpTransport, and falls back to the REST discovery
+        client when it fails, unless pubsub_endpoint is set.
         """
 
         self._config = config
@@ -45,75 +71,162 @@ class GooglePubSub(object):
         self._config["service_name"] = "pubsub"
         self._config["version"] = "v1"
         self._logger = logger
-        self._client = gwc.create_google_client(self._config)
+        self._rest_client = None
+        self._transport = None
+        if self._config.get("pubsub_transport") == "persistent":
+            self._transport = gpt.GooglePubSubHttpTransport(self._config)
+        else:
+            self._rest_client = gwc.create_google_client(self._config)
+        self._subscription = None
+        if self._config.get("google_subscription"):
+            self._subscription = get_full_subscription_name(
+                self._config["google_project"],
+                self._config["google_subscription"])
 
-    def pull_messages(self):
-        """Pull messages from a given subscription."""
+        base64encoded = str(self._config.get("base64encoded", ""))
+        self._base64encoded = base64encoded.lower() in [
+            "1", "true", "t", "yes", "y"]
 
-        subscription = get_full_subscription_name(
-            self._config["google_project"],
-            self._config["google_subscription"])
+    @property
+    def _client(self):
+        if self._rest_client is None:
+            self._rest_client = gwc.create_google_client(self._config)
+        return self._rest_client
 
-        body = {
-            "returnImmediately": False,
-            "maxMessages": self._config.get("batch_size", 100)
-        }
+    def _call_transport(self, method, *args):
+        """
+        :return: (True, result) if the call is done by the persistent
+        transport, (False, None) if the caller shall fall back to REST
+        """
 
-        base64encoded = str(self._config.get("base64encoded", ""))
-        base64encoded = base64encoded.lower() in ["1", "true", "t", "yes", "y"]
+        if self._transport is None:
+            return False, None
+
+        try:
+            return True, getattr(self._transport, method)(*args)
+        except Exception:
+            if self._config.get("pubsub_endpoint"):
+                raise
+
+            self._logger.error(
+                "Failed to %s through persistent transport, fall back to "
+                "REST, error=%s", method, traceback.format_exc())
+            return False, None
+
+    def pull_messages(self):
+        """Pull messages from a given subscription."""
 
         while 1:
             try:
-                resp = self._client.projects().subscriptions().pull(
-                    subscription=subscription, body=body).execute(
-                    num_retries=3)
-            except ssl.SSLError as e:
-                if "timed out" in e.message:
-                    yield []
-                    continue
+                messages = self.pull_once()
+                if self._base64encoded:
+                    decode_messages(self._logger, messages)
             except Exception:
                 self._logger.error(
                     "Failed to pull messages from subscription=%s, error=%s",
-                    subscription, traceback.format_exc())
+                    self._subscription, traceback.format_exc())
                 time.sleep(2)
                 continue
 
-            messages = resp.get("receivedMessages")
-            if not messages:
-                yield []
+            yield messages
 
-            if base64encoded:
-                for message in messages:
-                    msg = message.get("message")
-                    if msg and msg.get("data"):
-                        try:
-                            msg["data"] = base64.b64decode(str(msg["data"]))
-                        except TypeError:
-                            logger.error(
-                                "Invalid base64 event=%s", msg["data"])
+    def pull_once(self, max_messages=None):
+        """
+        Issue one pull request against the subscription.
+        :return: a list of received messages, empty list when the pull
+        times out or there is no message. The data of messages is not
+        base64 decoded, see decode_messages
+        """
 
-            yield messages
+        if max_messages is None:
+            max_messages = self._config.get("batch_size", 100)
+
+        done, messages = self._call_transport(
+            "pull", self._subscription, max_messages)
+        if done:
+            return messages
+
+        body = {
+            "returnImmediately": False,
+            "maxMessages": int(max_messages),
+        }
+
+        try:
+            resp = self._client.projects().subscriptions().pull(
+                subscription=self._subscription, body=body).execute(
+                num_retries=3)
+        except Exception as e:
+            if gpt.is_timeout(e):
+                return []
+            raise
+
+        return resp.get("receivedMessages") or []
 
     def ack_messages(self, messages):
         if not messages:
             return
 
-        ack_ids = []
-        for message in messages:
-            ack_ids.append(message.get("ackId"))
+        self.ack_ids([message.get("ackId") for message in messages])
 
-        ack_body = {"ackIds": ack_ids}
-        subscription = get_full_subscription_name(
-            self._config["google_project"],
-            self._config["google_subscription"])
+    def ack_ids(self, ack_ids):
+        if not ack_ids:
+            return
 
+        done, _ = self._call_transport(
+            "acknowledge", self._subscription, ack_ids)
+        if done:
+            return
+
+        ack_body = {"ackIds": ack_ids}
         self._client.projects().subscriptions().acknowledge(
-            subscription=subscription, body=ack_body).execute(num_retries=3)
+            subscription=self._subscription, body=ack_body).execute(
+            num_retries=3)
+
+    def modify_ack_deadline(self, ack_ids, ack_deadline_seconds):
+        if not ack_ids:
+            return
+
+        done, _ = self._call_transport(
+            "modify_ack_deadline", self._subscription, ack_ids,
+            ack_deadline_seconds)
+        if done:
+            return
+
+        body = {
+            "ackIds": ack_ids,
+            "ackDeadlineSeconds": int(ack_deadline_seconds),
+        }
+        self._client.projects().subscriptions().modifyAckDeadline(
+            subscription=self._subscription, body=body).execute(
+            num_retries=3)
+
+    def get_subscription(self):
+        """
+        return the subscription resource
+        {
+        "topic": "projects/zlchenken/topics/test_topic",
+        "ackDeadlineSeconds": 10,
+        "pushConfig": {},
+        "name": "projects/zlchenken/subscriptions/sub_test_topic"
+        }
+        """
+
+        done, subscription = self._call_transport(
+            "get_subscription", self._subscription)
+        if done:
+            return subscription
+
+        return self._client.projects().subscriptions().get(
+            subscription=self._subscription).execute(num_retries=3)
 
     def publish_messages(self, messages):
         topic = get_full_topic_name(
             self._config["google_project"], self._config["google_topic"])
         messages = [{"data": base64.b64encode(msg)} for msg in messages]
+        done, result = self._call_transport("publish", topic, messages)
+        if done:
+            return result
+
         body = {"messages": messages}
         return self._client.projects().topics().publish(
             topic=topic, body=body).execute(num_retries=3)
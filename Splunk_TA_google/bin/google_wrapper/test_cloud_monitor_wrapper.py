@@ -0,0 +1,128 @@
+import logging
+import sys
+import unittest as ut
+
+sys.path.append("../")
+
+import httplib2
+from googleapiclient.errors import HttpError
+
+import google_wrapper.cloud_monitor_wrapper as gmw
+
+
+class _EpochParser(object):
+
+    def parse(self, times):
+        return times
+
+
+class _Request(object):
+
+    def __init__(self, pages, index, kwargs):
+        self.pages = pages
+        self.index = index
+        self.kwargs = kwargs
+
+    def execute(self, num_retries=0):
+        if "window" in self.kwargs:
+            raise HttpError(httplib2.Response({"status": 400}),
+                            "can't align")
+
+        result = {"timeseries": self.pages[self.index]}
+        if self.index + 1 < len(self.pages):
+            result["nextPageToken"] = str(self.index + 1)
+        return result
+
+
+class _Timeseries(object):
+
+    def __init__(self, pages):
+        self._pages = pages
+
+    def list(self, **kwargs):
+        return _Request(self._pages, 0, kwargs)
+
+    def list_next(self, req, result):
+        if "nextPageToken" not in result:
+            return None
+        return _Request(req.pages, req.index + 1, req.kwargs)
+
+
+class _Client(object):
+
+    def __init__(self, pages):
+        self._timeseries = _Timeseries(pages)
+
+    def timeseries(self):
+        return self._timeseries
+
+
+def _series(name, points):
+    return {
+        "timeseriesDesc": {"metric": "m", "labels": {"name": name}},
+        "points": [{"end": end, "doubleValue": value}
+                   for end, value in points],
+    }
+
+
+class TestTimeseriesAggregator(ut.TestCase):
+
+    def testFractionalEnds(self):
+        series = {"points": [{"end": end, "int64Value": "1"}
+                             for end in (300, 300.5, 600, 299.2)]}
+        aggregator = gmw.TimeseriesAggregator(300, "sum", _EpochParser())
+        aggregator.add([series])
+        points = aggregator.get_timeseries()[0]["points"]
+        self.assertEqual(
+            [(p["start"], p["int64Value"]) for p in points],
+            [("1970-01-01T00:05:00Z", "2"), ("1970-01-01T00:00:00Z", "2")])
+
+    def testSeriesAcrossPages(self):
+        aggregator = gmw.TimeseriesAggregator(300, "mean", _EpochParser())
+        aggregator.add([_series("a", [(200, 5), (100, 1)])])
+        aggregator.add([_series("a", [(50, 9)]), _series("b", [(400, 2)])])
+        timeseries = aggregator.get_timeseries()
+        self.assertEqual(
+            [(s["timeseriesDesc"]["labels"]["name"], s["points"])
+             for s in timeseries],
+            [("a", [{"start": "1970-01-01T00:00:00Z",
+                     "end": "1970-01-01T00:05:00Z", "doubleValue": 5.0}]),
+             ("b", [{"start": "1970-01-01T00:05:00Z",
+                     "end": "1970-01-01T00:10:00Z", "doubleValue": 2.0}])])
+
+
+class TestIterMetrics(ut.TestCase):
+
+    def testLocalAggregationAcrossPages(self):
+        pages = [
+            [_series("a", [("1970-01-01T00:03:20Z", 5),
+                           ("1970-01-01T00:01:40Z", 1)])],
+            [_series("a", [("1970-01-01T00:00:50Z", 9)])],
+        ]
+        mon = gmw.GoogleCloudMonitor.__new__(gmw.GoogleCloudMonitor)
+        mon._logger = logging.getLogger("test_cloud_monitor_wrapper")
+        mon._logger.addHandler(logging.NullHandler())
+        mon._client = _Client(pages)
+        mon._unaligned_metrics = set()
+
+        params = {
+            "google_project": "p",
+            "google_metric": "m",
+            "oldest": "1970-01-01T00:00:00-00:00",
+            "youngest": "1970-01-01T00:05:00-00:00",
+            "alignment_period": 300,
+            "reducer": "mean",
+        }
+        results = list(mon.iter_metrics(params))
+        self.assertEqual(len(results), 1)
+        self.assertEqual(len(results[0]), 1)
+        self.assertEqual(results[0][0]["points"], [{
+            "start": "1970-01-01T00:00:00Z",
+            "end": "1970-01-01T00:05:00Z",
+            "doubleValue": 5.0,
+        }])
+        self.assertEqual(mon._unaligned_metrics, set(["m"]))
+
+
+if __name__ == "__main__":
+    ut.main()
@@ -0,0 +1,108 @@
+import threading
+import traceback
+import time
+
+import google_wrapper.pubsub_wrapper as gpw
+
+
+class GooglePubSubAcker(object):
+    """
+    Acknowledge messages in a background thread. AckIds are gathered from
+    several batches and flushed in one acknowledge call when there are
+    ack_batch_size of them pending or every ack_interval seconds. AckIds
+    queued after tear_down, for instance by event writer callbacks of
+    batches drained when the writer is torn down, are acked right away.
+    """
+
+    def __init__(self, logger, config, ack_batch_size=1000, ack_interval=1):
+        """
+        :param config: GooglePubSub config
+        """
+
+        self._logger = logger
+        self._config = config
+        self._ack_batch_size = max(int(ack_batch_size), 1)
+        self._ack_interval = float(ack_interval)
+        self._pending = []
+        self._cond = threading.Condition(threading.Lock())
+        self._thr = threading.Thread(target=self._do_ack)
+        self._thr.daemon = True
+        self._started = False
+        self._stopped = False
+        # For ackIds queued after the ack thread is stopped
+        self._late_lock = threading.Lock()
+        self._late_sub = None
+
+    def start(self):
+        if self._started:
+            return
+        self._started = True
+
+        self._thr.start()
+
+    def tear_down(self):
+        """
+        Flush all pending ackIds and stop the ack thread
+        """
+
+        if not self._started:
+            return
+        self._started = False
+
+        with self._cond:
+            self._stopped = True
+            self._cond.notify()
+        self._thr.join()
+
+    def ack(self, ack_ids):
+        """
+        Queue ackIds for acknowledgement, it is thread safe. Clients shall
+        only call it after the events have been delivered. Once the ack
+        thread is stopped, ackIds are acked in the calling thread.
+        """
+
+        if not ack_ids:
+            return
+
+        with self._cond:
+            if not self._stopped:
+                self._pending.extend(ack_ids)
+                if len(self._pending) >= self._ack_batch_size:
+                    self._cond.notify()
+                return
+
+        with self._late_lock:
+            if self._late_sub is None:
+                self._late_sub = gpw.GooglePubSub(self._logger, self._config)
+            for i in xrange(0, len(ack_ids), self._ack_batch_size):
+                self._flush(self._late_sub,
+                            ack_ids[i:i + self._ack_batch_size])
+
+    def _do_ack(self):
+        sub = gpw.GooglePubSub(self._logger, self._config)
+        stopped = False
+        while not stopped:
+            with self._cond:
+                if (not self._stopped and
+                        len(self._pending) < self._ack_batch_size):
+                    self._cond.wait(self._ack_interval)
+                pending, self._pending = self._pending, []
+                stopped = self._stopped
+
+            for i in xrange(0, len(pending), self._ack_batch_size):
+                self._flush(sub, pending[i:i + self._ack_batch_size])
+
+    def _flush(self, sub, ack_ids):
+        for _ in range(3):
+            try:
+                sub.ack_ids(ack_ids)
+            except Exception:
+                self._logger.error(
+                    "Failed to ack %d messages for project=%s, "
+                    "subscription=%s, error=%s", len(ack_ids),
+                    self._config["google_project"],
+                    self._config["google_subscription"],
+                    traceback.format_exc())
+                time.sleep(1)
+            else:
+                return
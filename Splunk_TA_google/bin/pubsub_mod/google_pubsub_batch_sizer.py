@@ -0,0 +1,57 @@
+import threading
+
+
+class GooglePubSubBatchSizer(object):
+    """
+    Tune maxMessages of pull requests from observed pulls. The batch size
+    doubles while pulls come back full within max_latency and halves when
+    pulls return less than a quarter of the batch size or fail. It is
+    shared by all pullers of one subscription.
+    """
+
+    _shrink_ratio = 0.25
+
+    def __init__(self, logger, name, batch_size=100, min_batch_size=10,
+                 max_batch_size=1000, max_latency=5):
+        """
+        :param name: used in logs to identify the subscription
+        :param max_latency: seconds, full pulls slower than it don't grow
+        the batch size
+        """
+
+        self._logger = logger
+        self._name = name
+        self._min_batch_size = max(int(min_batch_size), 1)
+        self._max_batch_size = max(int(max_batch_size),
+                                   self._min_batch_size)
+        self._max_latency = float(max_latency)
+        self._batch_size = min(max(int(batch_size), self._min_batch_size),
+                               self._max_batch_size)
+        self._lock = threading.Lock()
+
+    def batch_size(self):
+        return self._batch_size
+
+    def update(self, requested, received, latency):
+        """
+        :param requested: maxMessages of the pull
+        :param received: number of messages returned, 0 when timed out
+        :param latency: seconds the pull took
+        :return: the new batch size
+        """
+
+        with self._lock:
+            if received >= requested and latency <= self._max_latency:
+                new_size = min(self._batch_size * 2, self._max_batch_size)
+            elif received < requested * self._shrink_ratio:
+                new_size = max(self._batch_size / 2, self._min_batch_size)
+            else:
+                return self._batch_size
+
+            if new_size != self._batch_size:
+                self._logger.info(
+                    "Change pull batch_size from %d to %d for %s, "
+                    "received=%d, latency=%.3f", self._batch_size, new_size,
+                    self._name, received, latency)
+                self._batch_size = new_size
+            return self._batch_size
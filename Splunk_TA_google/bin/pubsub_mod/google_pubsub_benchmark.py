@@ -0,0 +1,145 @@
+"""
+Benchmark Pub/Sub collection end to end against a local fake Pub/Sub server.
+Messages are published through GooglePubSubPublisher and collected by
+GooglePubSubDataLoader, each message carries its publish time so the
+publish to index latency is measured when the event writer gets it.
+
+Usage:
+    python -m pubsub_mod.google_pubsub_benchmark --messages 100000
+"""
+
+import argparse
+import threading
+import logging
+import time
+
+import splunktalib.event_writer as ew
+import google_ta_common.google_consts as ggc
+import google_wrapper.pubsub_publisher as gpp
+import pubsub_mod.google_pubsub_consts as gpc
+import pubsub_mod.google_pubsub_data_loader as gpdl
+import pubsub_mod.google_pubsub_fake_server as gpfs
+
+
+class _LatencyEventWriter(object):
+    """
+    Record the latency of each event from its publish time in the payload
+    and confirm the delivery right away
+    """
+
+    create_events = staticmethod(ew.HecEventWriter.create_events)
+
+    def __init__(self):
+        self.latencies = []
+        self.first = None
+        self.last = None
+        self._lock = threading.Lock()
+
+    def write_events(self, events, retry=3, callback=None):
+        now = time.time()
+        latencies = [now - float(evt["event"]["data"].split(" ", 1)[0])
+                     for evt in events]
+        with self._lock:
+            if self.first is None:
+                self.first = now
+            self.last = now
+            self.latencies.extend(latencies)
+
+        if callback is not None:
+            callback()
+
+    def count(self):
+        with self._lock:
+            return len(self.latencies)
+
+
+def _percentile(sorted_values, percent):
+    if not sorted_values:
+        return 0
+    idx = int(round(percent / 100.0 * (len(sorted_values) - 1)))
+    return sorted_values[idx]
+
+
+def run(args):
+    logger = logging.getLogger("google_pubsub_benchmark")
+    logger.addHandler(logging.StreamHandler())
+    logger.setLevel(logging.WARNING)
+
+    pubsub = gpfs.FakePubSub(ack_deadline=args.ack_deadline, pull_timeout=1)
+    pubsub.create_subscription("projects/bench/topics/bench_topic",
+                               "projects/bench/subscriptions/bench_sub")
+    server = gpfs.FakePubSubServer(pubsub)
+    server.start()
+
+    writer = _LatencyEventWriter()
+    config = {
+        ggc.event_writer: writer,
+        ggc.index: "main",
+        ggc.google_project: "bench",
+        gpc.google_topic: "bench_topic",
+        gpc.google_subscription: "bench_sub",
+        gpc.base64encoded: "1",
+        gpc.pull_concurrency: args.pull_concurrency,
+        gpc.batch_size: args.batch_size,
+        gpc.adaptive_batch_size: args.adaptive_batch_size,
+        gpc.ack_interval: 0.2,
+        "pubsub_transport": "persistent",
+        "pubsub_endpoint": server.endpoint(),
+    }
+
+    loader = gpdl.GooglePubSubDataLoader(dict(config))
+    loader_thr = threading.Thread(target=loader.index_data)
+    loader_thr.daemon = True
+    loader_thr.start()
+
+    publisher = gpp.GooglePubSubPublisher(
+        logger, dict(config), max_messages=args.publish_batch_size,
+        max_in_flight=args.publish_in_flight)
+    publisher.start()
+
+    padding = "x" * max(args.message_size - 18, 0)
+    start = time.time()
+    for _ in xrange(args.messages):
+        publisher.publish("{:.6f} {}".format(time.time(), padding))
+    publisher.tear_down()
+    publish_done = time.time()
+
+    deadline = publish_done + args.timeout
+    while writer.count() < args.messages and time.time() < deadline:
+        time.sleep(0.1)
+    loader.stop()
+    loader_thr.join(5)
+    server.tear_down()
+
+    indexed = writer.count()
+    latencies = sorted(writer.latencies)
+    elapsed = (writer.last or time.time()) - start
+    print "published={} publish_rate={:.0f} msg/s".format(
+        publisher.published, publisher.published / (publish_done - start))
+    print "indexed={} end_to_end_rate={:.0f} msg/s".format(
+        indexed, indexed / elapsed if elapsed else 0)
+    print "latency p50={:.3f}s p99={:.3f}s max={:.3f}s".format(
+        _percentile(latencies, 50), _percentile(latencies, 99),
+        latencies[-1] if latencies else 0)
+    print "fake_server={}".format(pubsub.get_stats())
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Benchmark Pub/Sub publish to index throughput and "
+                    "latency against a local fake Pub/Sub server")
+    parser.add_argument("--messages", type=int, default=100000)
+    parser.add_argument("--message-size", type=int, default=256)
+    parser.add_argument("--publish-batch-size", type=int, default=1000)
+    parser.add_argument("--publish-in-flight", type=int, default=4)
+    parser.add_argument("--pull-concurrency", type=int, default=4)
+    parser.add_argument("--batch-size", type=int, default=1000)
+    parser.add_argument("--adaptive-batch-size", type=int, default=0)
+    parser.add_argument("--ack-deadline", type=int, default=60)
+    parser.add_argument("--timeout", type=int, default=120,
+                        help="seconds to wait for indexing after publishing")
+    run(parser.parse_args())
+
+
+if __name__ == "__main__":
+    main()
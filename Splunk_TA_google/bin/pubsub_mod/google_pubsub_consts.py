@@ -10,3 +10,19 @@ google_topic = "google_topic"
 google_subscription = "google_subscription"
 base64encoded = "base64encoded"
 batch_count = "batch_count"
+pull_concurrency = "pull_concurrency"
+ack_batch_size = "ack_batch_size"
+ack_interval = "ack_interval"
+lease_extension = "lease_extension"
+max_lease = "max_lease"
+max_outstanding_messages = "max_outstanding_messages"
+max_outstanding_bytes = "max_outstanding_bytes"
+process_max_outstanding_messages = "process_max_outstanding_messages"
+process_max_outstanding_bytes = "process_max_outstanding_bytes"
+batch_size = "batch_size"
+adaptive_batch_size = "adaptive_batch_size"
+min_batch_size = "min_batch_size"
+max_batch_size = "max_batch_size"
+max_pull_latency = "max_pull_latency"
+dedup_max_entries = "dedup_max_entries"
+dedup_window = "dedup_window"
@@ -1,13 +1,26 @@
 import traceback
 import time
+import Queue
 
 from splunktalib.common import log
 logger = log.Logs().get_logger("main")
 
 
+import splunktalib.common.util as scutil
 import google_ta_common.google_consts as ggc
 import pubsub_mod.google_pubsub_consts as gpc
 import google_wrapper.pubsub_wrapper as gpw
+import pubsub_mod.google_pubsub_puller as gpp
+import pubsub_mod.google_pubsub_acker as gpa
+import pubsub_mod.google_pubsub_leaser as gpl
+import pubsub_mod.google_pubsub_flow_control as gpfc
+import pubsub_mod.google_pubsub_batch_sizer as gpbs
+import pubsub_mod.google_pubsub_dedup as gpd
+import google_ta_common.google_time_parser as gtp
+
+
+def _messages_size(msgs):
+    return sum(len(msg["message"].get("data", "")) for msg in msgs)
 
 
 class GooglePubSubDataLoader(object):
@@ -27,6 +40,22 @@ class GooglePubSubDataLoader(object):
             "google_credentials": xxx,
             "google_project": xxx,
             "google_subscription": xxx,
+            "pull_concurrency": xxx,
+            "batch_size": xxx,
+            "adaptive_batch_size": xxx,
+            "min_batch_size": xxx,
+            "max_batch_size": xxx,
+            "max_pull_latency": xxx,
+            "ack_batch_size": xxx,
+            "ack_interval": xxx,
+            "lease_extension": xxx,
+            "max_lease": xxx,
+            "max_outstanding_messages": xxx,
+            "max_outstanding_bytes": xxx,
+            "process_max_outstanding_messages": xxx,
+            "process_max_outstanding_bytes": xxx,
+            "dedup_max_entries": xxx,
+            "dedup_window": xxx,
             "index": xxx,
         }
         """
@@ -37,6 +66,10 @@ class GooglePubSubDataLoader(object):
             subscription=self._config[gpc.google_subscription])
         self._running = False
         self._stopped = False
+        self._base64encoded = scutil.is_true(
+            self._config.get(gpc.base64encoded))
+        self._deduper = self._create_deduper()
+        self._time_parser = gtp.UTCTimeParser()
 
     def get_interval(self):
         return self._config[ggc.polling_interval]
@@ -78,14 +111,79 @@ class GooglePubSubDataLoader(object):
             "record_report_start": time.time()
         }
 
-        sub = gpw.GooglePubSub(logger, self._config)
-        while not self._stopped:
-            for msgs in sub.pull_messages():
-                if msgs:
-                    self._index_messages(msgs, msgs_metrics)
-                    sub.ack_messages(msgs)
+        self._acker = gpa.GooglePubSubAcker(
+            logger, self._config,
+            self._config.get(gpc.ack_batch_size, 1000),
+            self._config.get(gpc.ack_interval, 1))
+        self._acker.start()
+        self._leaser = gpl.GooglePubSubLeaser(
+            logger, self._config,
+            self._config.get(gpc.lease_extension, 60),
+            self._config.get(gpc.max_lease, 3600))
+        self._leaser.start()
+        self._flow_controller = self._create_flow_controller()
+        pullers = self._start_pullers()
+        try:
+            while not self._stopped:
+                try:
+                    msgs = self._msg_queue.get(timeout=2)
+                except Queue.Empty:
+                    continue
+
+                self._index_messages(msgs, msgs_metrics)
+        finally:
+            for puller in pullers:
+                puller.stop()
+            self._leaser.tear_down()
+            # Batches the event writer delivers later are acked right away
+            # by the stopped acker
+            self._acker.tear_down()
         self._running = False
 
+    def _start_pullers(self):
+        concurrency = max(int(self._config.get(gpc.pull_concurrency, 1)), 1)
+        self._msg_queue = Queue.Queue(concurrency)
+        batch_sizer = self._create_batch_sizer()
+        pullers = []
+        for i in xrange(concurrency):
+            name = "{}_puller_{}".format(self._source, i)
+            puller = gpp.GooglePubSubPuller(
+                logger, self._config, self._msg_queue, self._leaser,
+                self._flow_controller, batch_sizer, name)
+            puller.start()
+            pullers.append(puller)
+        logger.info("Started %d pullers for project=%s, subscription=%s",
+                    concurrency, self._config[ggc.google_project],
+                    self._config[gpc.google_subscription])
+        return pullers
+
+    def _create_batch_sizer(self):
+        if not scutil.is_true(self._config.get(gpc.adaptive_batch_size)):
+            return None
+
+        return gpbs.GooglePubSubBatchSizer(
+            logger, self._source, self._config.get(gpc.batch_size, 100),
+            self._config.get(gpc.min_batch_size, 10),
+            self._config.get(gpc.max_batch_size, 1000),
+            self._config.get(gpc.max_pull_latency, 5))
+
+    def _create_deduper(self):
+        max_entries = int(self._config.get(gpc.dedup_max_entries, 0))
+        if max_entries <= 0:
+            return None
+
+        return gpd.GooglePubSubDeduper(
+            max_entries, self._config.get(gpc.dedup_window, 0))
+
+    def _create_flow_controller(self):
+        process_flow_controller = gpfc.get_process_flow_controller(
+            self._config.get(gpc.process_max_outstanding_messages, 0),
+            self._config.get(gpc.process_max_outstanding_bytes, 0))
+        return gpfc.GooglePubSubFlowController(
+            self._config.get(gpc.max_outstanding_messages, 0),
+            self._config.get(gpc.max_outstanding_bytes, 0),
+            process_flow_controller)
+
     def _index_messages(self, msgs, msgs_metrics):
         msgs_metrics["current_record_count"] += len(msgs)
         current_count = msgs_metrics["current_record_count"]
@@ -97,17 +195,55 @@ class GooglePubSubDataLoader(object):
                 time.time() - msgs_metrics["record_report_start"])
             msgs_metrics["record_report_start"] = time.time()
             msgs_metrics["current_record_count"] = 0
-        self._write_events(msgs)
+            if self._deduper is not None:
+                logger.info(
+                    "De-duplication stats=%s for project=%s, subscription=%s",
+                    self._deduper.stats(), self._config[ggc.google_project],
+                    self._config[gpc.google_subscription])
+
+        if self._deduper is None:
+            return self._write_events(msgs)
+
+        msgs, duplicates = self._deduper.filter(msgs)
+        if duplicates:
+            # Drop them but ack, they have been indexed before
+            self._on_delivered(
+                [msg["ackId"] for msg in duplicates],
+                _messages_size(duplicates))
+
+        if not msgs:
+            return True
+        return self._write_events(msgs)
 
     def _write_events(self, msgs):
+        """
+        :return: True if the events have been handed over to the event
+        writer, False if the loader is stopped before that. The messages
+        are acked after the event writer confirms the delivery
+        """
+
+        ack_ids = [msg["ackId"] for msg in msgs]
+        size = _messages_size(msgs)
+        message_ids = None
+        if self._deduper is not None:
+            message_ids = [msg["message"].get("messageId") for msg in msgs]
+        if self._base64encoded:
+            # Decode off the pull threads, once per batch
+            gpw.decode_messages(logger, msgs)
         msgs = [msg["message"] for msg in msgs]
+        times = self._time_parser.parse(
+            [msg.get("publishTime") for msg in msgs])
         events = self._config[ggc.event_writer].create_events(
             index=self._config[ggc.index], host=None, source=self._source,
-            sourcetype="google:pubsub", time=None, unbroken=False, done=False,
-            events=msgs)
+            sourcetype="google:pubsub", time=times, unbroken=False,
+            done=False, events=msgs)
         while not self._stopped:
             try:
-                self._config[ggc.event_writer].write_events(events, retry=1)
+                self._config[ggc.event_writer].write_events(
+                    events, retry=1,
+                    callback=lambda: self._on_delivered(
+                        ack_ids, size, message_ids))
+                return True
             except Exception:
                 logger.error(
                     "Failed to index events for project=%s, subscription=%s, "
@@ -115,6 +251,15 @@ class GooglePubSubDataLoader(object):
                     self._config[gpc.google_subscription],
                     traceback.format_exc())
                 time.sleep(2)
+        return False
+
+    def _on_delivered(self, ack_ids, size, message_ids=None):
+        if message_ids:
+            # Only delivered messages are duplicates when redelivered
+            self._deduper.remember(message_ids)
+        self._flow_controller.release(len(ack_ids), size)
+        self._leaser.remove(ack_ids)
+        self._acker.ack(ack_ids)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,85 @@
+import collections
+import threading
+import time
+
+
+class GooglePubSubDeduper(object):
+    """
+    Remember the messageIds of recently indexed messages to drop redelivered
+    ones. The cache is an LRU capped by max_entries, entries older than
+    window seconds are expired as well when window is set. MessageIds are
+    only remembered once the delivery of their events is confirmed, so a
+    message whose events are lost is indexed again when it is redelivered.
+    It is thread safe.
+    """
+
+    def __init__(self, max_entries=100000, window=0):
+        """
+        :param max_entries: max number of messageIds remembered
+        :param window: seconds a messageId is remembered, 0 means no limit
+        """
+
+        self._max_entries = max(int(max_entries), 1)
+        self._window = float(window)
+        # messageId -> time seen
+        self._seen = collections.OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def filter(self, msgs):
+        """
+        :param msgs: received messages returned by GooglePubSub.pull_once
+        :return: (unique_msgs, duplicate_msgs), duplicates are messages
+        whose delivery was confirmed before
+        """
+
+        unique, duplicates = [], []
+        with self._lock:
+            self._expire(time.time())
+            seen = self._seen
+            for msg in msgs:
+                if msg["message"].get("messageId") in seen:
+                    duplicates.append(msg)
+                else:
+                    unique.append(msg)
+            self.hits += len(duplicates)
+            self.misses += len(unique)
+        return unique, duplicates
+
+    def remember(self, message_ids):
+        """
+        Remember message_ids whose events have been delivered
+        """
+
+        now = time.time()
+        with self._lock:
+            seen = self._seen
+            for message_id in message_ids:
+                if message_id is None:
+                    continue
+                seen.pop(message_id, None)
+                seen[message_id] = now
+
+            while len(seen) > self._max_entries:
+                seen.popitem(last=False)
+
+    def stats(self):
+        with self._lock:
+            return {
+                "dedup_entries": len(self._seen),
+                "dedup_hits": self.hits,
+                "dedup_misses": self.misses,
+            }
+
+    def _expire(self, now):
+        if not self._window:
+            return
+
+        seen = self._seen
+        oldest = now - self._window
+        while seen:
+            message_id, seen_time = next(seen.iteritems())
+            if seen_time >= oldest:
+                break
+            del seen[message_id]
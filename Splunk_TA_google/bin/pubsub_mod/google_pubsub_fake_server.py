@@ -0,0 +1,269 @@
+"""
+A local fake Pub/Sub server which implements the v1 REST publish, pull,
+acknowledge and modifyAckDeadline methods in memory. It is used to exercise
+GooglePubSub with pubsub_transport=persistent and pubsub_endpoint pointing
+to it, without a Google project, by the Pub/Sub benchmark.
+"""
+
+import BaseHTTPServer
+import SocketServer
+import socket
+import sys
+import threading
+import json
+import time
+import itertools
+import collections
+
+
+class FakePubSub(object):
+
+    def __init__(self, ack_deadline=10, pull_timeout=5):
+        """
+        :param ack_deadline: seconds before an unacked message is redelivered
+        :param pull_timeout: seconds a pull waits for messages
+        """
+
+        self.ack_deadline = ack_deadline
+        self.pull_timeout = pull_timeout
+        # topic -> [subscription]
+        self._topics = collections.defaultdict(list)
+        # subscription -> deque of (message_id, data, publish_time)
+        self._backlogs = {}
+        # ack_id -> (subscription, message, deadline)
+        self._outstanding = {}
+        self._ids = itertools.count(1)
+        self._cond = threading.Condition(threading.Lock())
+        # Updated with _cond held, read it through get_stats
+        self.stats = collections.Counter()
+
+    def create_subscription(self, topic, subscription):
+        """
+        :param topic: projects/{project}/topics/{topic}
+        :param subscription: projects/{project}/subscriptions/{subscription}
+        """
+
+        with self._cond:
+            self._topics[topic].append(subscription)
+            self._backlogs[subscription] = collections.deque()
+
+    def get_subscription(self, subscription):
+        with self._cond:
+            for topic, subscriptions in self._topics.iteritems():
+                if subscription in subscriptions:
+                    return {
+                        "name": subscription,
+                        "topic": topic,
+                        "ackDeadlineSeconds": self.ack_deadline,
+                    }
+        raise KeyError(subscription)
+
+    def publish(self, topic, body):
+        now = time.time()
+        publish_time = time.strftime(
+            "%Y-%m-%dT%H:%M:%S", time.gmtime(now)) + ".{:03d}Z".format(
+            int(now * 1000) % 1000)
+        message_ids = []
+        with self._cond:
+            for msg in body.get("messages", []):
+                message_id = str(next(self._ids))
+                message_ids.append(message_id)
+                for subscription in self._topics[topic]:
+                    self._backlogs[subscription].append(
+                        (message_id, msg.get("data", ""), publish_time))
+            self.stats["published"] += len(message_ids)
+            self._cond.notify_all()
+        return {"messageIds": message_ids}
+
+    def pull(self, subscription, body):
+        max_messages = int(body.get("maxMessages", 100))
+        deadline = time.time() + self.pull_timeout
+        with self._cond:
+            backlog = self._backlogs[subscription]
+            while 1:
+                self._redeliver_expired()
+                if backlog or body.get("returnImmediately"):
+                    break
+
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    break
+                self._cond.wait(min(remaining, 1))
+
+            received = []
+            ack_deadline = time.time() + self.ack_deadline
+            while backlog and len(received) < max_messages:
+                message = backlog.popleft()
+                ack_id = "{}-{}".format(message[0], next(self._ids))
+                self._outstanding[ack_id] = [
+                    subscription, message, ack_deadline]
+                received.append({
+                    "ackId": ack_id,
+                    "message": {
+                        "messageId": message[0],
+                        "data": message[1],
+                        "publishTime": message[2],
+                    },
+                })
+            self.stats["pulled"] += len(received)
+            self.stats["pull_requests"] += 1
+        return {"receivedMessages": received} if received else {}
+
+    def acknowledge(self, subscription, body):
+        with self._cond:
+            for ack_id in body.get("ackIds", []):
+                if self._outstanding.pop(ack_id, None) is not None:
+                    self.stats["acked"] += 1
+            self.stats["ack_requests"] += 1
+        return {}
+
+    def modify_ack_deadline(self, subscription, body):
+        deadline = time.time() + int(body.get("ackDeadlineSeconds", 0))
+        with self._cond:
+            for ack_id in body.get("ackIds", []):
+                if ack_id in self._outstanding:
+                    self._outstanding[ack_id][2] = deadline
+            self.stats["modify_ack_deadline_requests"] += 1
+        return {}
+
+    def get_stats(self):
+        with self._cond:
+            return dict(self.stats)
+
+    def _redeliver_expired(self):
+        now = time.time()
+        expired = [ack_id for ack_id, outstanding
+                   in self._outstanding.iteritems() if outstanding[2] <= now]
+        for ack_id in expired:
+            subscription, message, _ = self._outstanding.pop(ack_id)
+            self._backlogs[subscription].appendleft(message)
+            self.stats["redelivered"] += 1
+
+
+class _Handler(BaseHTTPServer.BaseHTTPRequestHandler):
+
+    protocol_version = "HTTP/1.1"
+
+    def do_GET(self):
+        try:
+            result = self.server.pubsub.get_subscription(self.path[4:])
+        except KeyError:
+            self._reply(404, {"error": "unknown resource {}".format(
+                self.path)})
+        else:
+            self._reply(200, result)
+
+    def do_POST(self):
+        length = int(self.headers.getheader("content-length") or 0)
+        body = json.loads(self.rfile.read(length) or "{}")
+        path = self.path
+        if path.startswith("/v1/"):
+            path = path[4:]
+        resource, _, method = path.partition(":")
+        pubsub = self.server.pubsub
+        handlers = {
+            "publish": pubsub.publish,
+            "pull": pubsub.pull,
+            "acknowledge": pubsub.acknowledge,
+            "modifyAckDeadline": pubsub.modify_ack_deadline,
+        }
+
+        if method not in handlers:
+            self._reply(404, {"error": "unknown method {}".format(method)})
+            return
+
+        try:
+            result = handlers[method](resource, body)
+        except KeyError:
+            self._reply(404, {"error": "unknown resource {}".format(resource)})
+        else:
+            self._reply(200, result)
+
+    def _reply(self, status, result):
+        content = json.dumps(result)
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(content)))
+        self.end_headers()
+        self.wfile.write(content)
+
+    def log_message(self, fmt, *args):
+        pass
+
+
+class FakePubSubServer(SocketServer.ThreadingMixIn,
+                       BaseHTTPServer.HTTPServer):
+
+    daemon_threads = True
+
+    def __init__(self, pubsub, port=0):
+        BaseHTTPServer.HTTPServer.__init__(self, ("127.0.0.1", port), _Handler)
+        self.pubsub = pubsub
+        self._thr = threading.Thread(target=self.serve_forever)
+        self._thr.daemon = True
+        self._handler_thrs = []
+
+    def endpoint(self):
+        return "http://127.0.0.1:{}".format(self.server_address[1])
+
+    def start(self):
+        self._thr.start()
+
+    def tear_down(self):
+        self.shutdown()
+        self.server_close()
+        for request, thr in self._handler_thrs:
+            try:
+                request.shutdown(socket.SHUT_RDWR)
+            except socket.error:
+                pass
+            thr.join()
+
+    def handle_error(self, request, client_address):
+        # Clients dropping connections, for instance in the middle of a
+        # long pull when they are stopped, are not errors of the server
+        if not isinstance(sys.exc_info()[1], socket.error):
+            BaseHTTPServer.HTTPServer.handle_error(
+                self, request, client_address)
+
+    def process_request(self, request, client_address):
+        # Track keep-alive connections to close them when tearing down
+        thr = threading.Thread(target=self.process_request_thread,
+                               args=(request, client_address))
+        thr.daemon = True
+        self._handler_thrs.append((request, thr))
+        thr.start()
+
+
+if __name__ == "__main__":
+    import logging
+    import google_wrapper.pubsub_wrapper as gpw
+
+    logger = logging.getLogger("google")
+    logger.addHandler(logging.StreamHandler())
+
+    pubsub = FakePubSub(pull_timeout=1)
+    pubsub.create_subscription("projects/test/topics/test_topic",
+                               "projects/test/subscriptions/test_sub")
+    server = FakePubSubServer(pubsub)
+    server.start()
+
+    config = {
+        "google_project": "test",
+        "google_topic": "test_topic",
+        "google_subscription": "test_sub",
+        "pubsub_transport": "persistent",
+        "pubsub_endpoint": server.endpoint(),
+    }
+    ps = gpw.GooglePubSub(logger, config)
+    ps.publish_messages(["i am counting {}".format(i) for i in range(10)])
+    messages = ps.pull_once(5)
+    gpw.decode_messages(logger, messages)
+    assert [msg["message"]["data"] for msg in messages] == [
+        "i am counting {}".format(i) for i in range(5)]
+    ps.ack_messages(messages)
+    assert len(ps.pull_once(100)) == 5
+    assert ps.pull_once(100) == []
+    assert ps.get_subscription()["ackDeadlineSeconds"] == 10
+    print pubsub.get_stats()
+    server.tear_down()
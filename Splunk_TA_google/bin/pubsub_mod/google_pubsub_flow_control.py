@@ -0,0 +1,109 @@
+import threading
+
+
+class GooglePubSubFlowController(object):
+    """
+    Limit the number of messages and bytes which are pulled but not
+    delivered yet. Once either limit is reached, pulling pauses until the
+    outstanding messages and bytes drain below the low watermark. A flow
+    controller may have a parent, for instance the per process one, both
+    limits are enforced.
+    """
+
+    _low_watermark = 0.8
+
+    def __init__(self, max_messages=0, max_bytes=0, parent=None):
+        """
+        :param max_messages: 0 means no limit
+        :param max_bytes: 0 means no limit
+        :param parent: GooglePubSubFlowController
+        """
+
+        self._max_messages = max(int(max_messages), 0)
+        self._max_bytes = max(int(max_bytes), 0)
+        self._parent = parent
+        self._messages = 0
+        self._bytes = 0
+        self._paused = False
+        self._cond = threading.Condition(threading.Lock())
+
+    def acquire(self, count, size):
+        """
+        Account count messages of size bytes as outstanding
+        """
+
+        with self._cond:
+            self._messages += count
+            self._bytes += size
+            if self._over_limits(1):
+                self._paused = True
+
+        if self._parent is not None:
+            self._parent.acquire(count, size)
+
+    def release(self, count, size):
+        """
+        Account count messages of size bytes as delivered
+        """
+
+        with self._cond:
+            self._messages -= count
+            self._bytes -= size
+            if self._paused and not self._over_limits(self._low_watermark):
+                self._paused = False
+                self._cond.notify_all()
+
+        if self._parent is not None:
+            self._parent.release(count, size)
+
+    def wait_for_capacity(self, timeout=1):
+        """
+        Block until pulling is allowed or timeout
+        :return: True if pulling is allowed
+        """
+
+        with self._cond:
+            if self._paused:
+                self._cond.wait(timeout)
+            if self._paused:
+                return False
+
+        if self._parent is not None:
+            return self._parent.wait_for_capacity(timeout)
+        return True
+
+    def stats(self):
+        with self._cond:
+            return {
+                "outstanding_messages": self._messages,
+                "outstanding_bytes": self._bytes,
+                "paused": self._paused,
+            }
+
+    def _over_limits(self, ratio):
+        if self._max_messages and self._messages >= (
+                self._max_messages * ratio):
+            return True
+
+        if self._max_bytes and self._bytes >= self._max_bytes * ratio:
+            return True
+        return False
+
+
+_process_flow_controller = None
+_process_flow_controller_lock = threading.Lock()
+
+
+def get_process_flow_controller(max_messages=0, max_bytes=0):
+    """
+    :return: the GooglePubSubFlowController shared by all loaders in the
+    current process, it is created with the limits of the first caller
+    """
+
+    global _process_flow_controller
+
+    with _process_flow_controller_lock:
+        if _process_flow_controller is None:
+            _process_flow_controller = GooglePubSubFlowController(
+                max_messages, max_bytes)
+        return _process_flow_controller
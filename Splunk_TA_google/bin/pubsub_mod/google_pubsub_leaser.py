@@ -0,0 +1,165 @@
+import threading
+import traceback
+import time
+
+import google_wrapper.pubsub_wrapper as gpw
+
+
+class GooglePubSubLeaser(object):
+    """
+    Keep the leases of messages which are pulled but not acked yet. Before
+    the ack deadline of a message expires, the leaser extends it by calling
+    modifyAckDeadline in batches, so slow indexing doesn't cause Pub/Sub to
+    redeliver the message. Messages held longer than max_lease are no
+    longer extended and will be redelivered.
+    """
+
+    def __init__(self, logger, config, lease_extension=60, max_lease=3600,
+                 batch_size=1000, report_interval=60):
+        """
+        :param config: GooglePubSub config
+        :param lease_extension: seconds, new ack deadline set on extension
+        :param max_lease: seconds, max time a message is held
+        """
+
+        self._logger = logger
+        self._config = config
+        self._lease_extension = min(max(int(lease_extension), 10), 600)
+        self._max_lease = int(max_lease)
+        self._batch_size = max(int(batch_size), 1)
+        self._report_interval = int(report_interval)
+        self._ack_deadline = 10
+
+        # ackId -> [deadline, pulled_time, bytes]
+        self._leases = {}
+        self._inflight_bytes = 0
+        self._cond = threading.Condition(threading.Lock())
+        self._thr = threading.Thread(target=self._do_lease)
+        self._thr.daemon = True
+        self._started = False
+        self._stopped = False
+
+    def start(self):
+        if self._started:
+            return
+        self._started = True
+
+        self._thr.start()
+
+    def tear_down(self):
+        if not self._started:
+            return
+        self._started = False
+
+        with self._cond:
+            self._stopped = True
+            self._cond.notify()
+        self._thr.join()
+
+    def add(self, msgs):
+        """
+        Start leasing msgs, it is thread safe
+        :param msgs: received messages returned by GooglePubSub.pull_once
+        """
+
+        now = time.time()
+        deadline = now + self._ack_deadline
+        with self._cond:
+            for msg in msgs:
+                size = len(msg["message"].get("data", ""))
+                self._leases[msg["ackId"]] = [deadline, now, size]
+                self._inflight_bytes += size
+
+    def remove(self, ack_ids):
+        """
+        Stop leasing ack_ids, it is thread safe
+        """
+
+        with self._cond:
+            for ack_id in ack_ids:
+                lease = self._leases.pop(ack_id, None)
+                if lease is not None:
+                    self._inflight_bytes -= lease[2]
+
+    def stats(self):
+        """
+        :return: dict contains inflight_messages and inflight_bytes
+        """
+
+        with self._cond:
+            return {
+                "inflight_messages": len(self._leases),
+                "inflight_bytes": self._inflight_bytes,
+            }
+
+    def _do_lease(self):
+        sub = gpw.GooglePubSub(self._logger, self._config)
+        self._ack_deadline = self._get_ack_deadline(sub)
+        interval = max(self._ack_deadline / 3.0, 1)
+        last_report = time.time()
+        while 1:
+            with self._cond:
+                if not self._stopped:
+                    self._cond.wait(interval)
+                if self._stopped:
+                    break
+                ack_ids = self._collect_expiring(interval)
+
+            for i in xrange(0, len(ack_ids), self._batch_size):
+                self._extend(sub, ack_ids[i:i + self._batch_size])
+
+            if time.time() - last_report >= self._report_interval:
+                last_report = time.time()
+                self._report()
+
+    def _collect_expiring(self, interval):
+        now = time.time()
+        due = now + 2 * interval
+        new_deadline = now + self._lease_extension
+        expired, ack_ids = [], []
+        for ack_id, lease in self._leases.iteritems():
+            if now - lease[1] >= self._max_lease:
+                expired.append(ack_id)
+            elif lease[0] <= due:
+                lease[0] = new_deadline
+                ack_ids.append(ack_id)
+
+        for ack_id in expired:
+            self._inflight_bytes -= self._leases.pop(ack_id)[2]
+
+        if expired:
+            self._logger.warning(
+                "Drop leases of %d messages held longer than %s seconds for "
+                "project=%s, subscription=%s", len(expired), self._max_lease,
+                self._config["google_project"],
+                self._config["google_subscription"])
+        return ack_ids
+
+    def _extend(self, sub, ack_ids):
+        try:
+            sub.modify_ack_deadline(ack_ids, self._lease_extension)
+        except Exception:
+            self._logger.error(
+                "Failed to extend ack deadline of %d messages for "
+                "project=%s, subscription=%s, error=%s", len(ack_ids),
+                self._config["google_project"],
+                self._config["google_subscription"], traceback.format_exc())
+
+    def _get_ack_deadline(self, sub):
+        try:
+            subscription = sub.get_subscription()
+        except Exception:
+            self._logger.error(
+                "Failed to get ack deadline for project=%s, subscription=%s, "
+                "error=%s", self._config["google_project"],
+                self._config["google_subscription"], traceback.format_exc())
+            return self._ack_deadline
+        return int(subscription.get("ackDeadlineSeconds", self._ack_deadline))
+
+    def _report(self):
+        stats = self.stats()
+        self._logger.info(
+            "Leasing inflight_messages=%d, inflight_bytes=%d for project=%s, "
+            "subscription=%s", stats["inflight_messages"],
+            stats["inflight_bytes"], self._config["google_project"],
+            self._config["google_subscription"])
@@ -0,0 +1,111 @@
+import threading
+import Queue
+import traceback
+import time
+
+import google_wrapper.pubsub_wrapper as gpw
+
+
+class GooglePubSubPuller(object):
+    """
+    Pull one subscription in a background thread and feed the received
+    batches to a queue shared by all pullers of the same subscription.
+    Each puller owns its Google client since the underlying httplib2
+    connection is not thread safe.
+    """
+
+    def __init__(self, logger, config, msg_queue, leaser=None,
+                 flow_controller=None, batch_sizer=None, name="puller"):
+        """
+        :param config: GooglePubSub config
+        :param msg_queue: bounded Queue.Queue, the puller puts
+        received messages to it
+        :param leaser: GooglePubSubLeaser, received messages are leased
+        until they are acked
+        :param flow_controller: GooglePubSubFlowController, pulling pauses
+        when it is over limits. Clients shall release the messages from it
+        once they are delivered
+        :param batch_sizer: GooglePubSubBatchSizer, decides maxMessages of
+        each pull when it is set
+        """
+
+        self._logger = logger
+        self._config = config
+        self._msg_queue = msg_queue
+        self._leaser = leaser
+        self._flow_controller = flow_controller
+        self._batch_sizer = batch_sizer
+        self._thr = threading.Thread(target=self._do_pull, name=name)
+        self._thr.daemon = True
+        self._started = False
+        self._stopped = False
+
+    def start(self):
+        if self._started:
+            return
+        self._started = True
+
+        self._thr.start()
+
+    def stop(self):
+        self._stopped = True
+
+    def _do_pull(self):
+        sub = gpw.GooglePubSub(self._logger, self._config)
+        while not self._stopped:
+            if not self._has_capacity():
+                continue
+
+            try:
+                msgs = self._pull(sub)
+            except Exception:
+                self._logger.error(
+                    "Failed to pull messages from project=%s, "
+                    "subscription=%s, error=%s",
+                    self._config["google_project"],
+                    self._config["google_subscription"],
+                    traceback.format_exc())
+                time.sleep(2)
+                continue
+
+            if not msgs:
+                continue
+
+            if self._flow_controller is not None:
+                size = sum(len(msg["message"].get("data", "")) for msg in msgs)
+                self._flow_controller.acquire(len(msgs), size)
+
+            if self._leaser is not None:
+                self._leaser.add(msgs)
+
+            if not self._put(msgs):
+                break
+
+    def _pull(self, sub):
+        if self._batch_sizer is None:
+            return sub.pull_once()
+
+        batch_size = self._batch_sizer.batch_size()
+        start = time.time()
+        msgs = []
+        try:
+            msgs = sub.pull_once(batch_size)
+        finally:
+            self._batch_sizer.update(
+                batch_size, len(msgs), time.time() - start)
+        return msgs
+
+    def _has_capacity(self):
+        if self._flow_controller is None:
+            return True
+        return self._flow_controller.wait_for_capacity()
+
+    def _put(self, msgs):
+        while not self._stopped:
+            try:
+                self._msg_queue.put(msgs, timeout=1)
+            except Queue.Full:
+                continue
+            else:
+                return True
+        return False
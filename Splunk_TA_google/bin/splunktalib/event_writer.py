@@ -1,16 +1,23 @@
 import Queue
+import os.path as op
 import multiprocessing
 import threading
 import sys
 import json
+import re
 import traceback
 import time
+import itertools
+import uuid
+import zlib
 
 import splunktalib.common.util as scutil
 from splunktalib.common import log
 
 
 import splunktalib.rest as sr
+import splunktalib.spill_queue as ssq
+import splunktalib.shm_ring as sshm
 
 logger = log.Logs().get_logger("util")
 
@@ -18,52 +25,109 @@ logger = log.Logs().get_logger("util")
 scutil.disable_stdout_buffer()
 
 
-class ModinputEvent(object):
+_xml_special_chars = re.compile(r"[&<>]")
+
+
+def _escape_data(data):
+    """
+    :return: utf-8 str of data with &, < and > escaped, data which is not a
+    string is JSON encoded
+    """
 
-    base_fmt = ("""<event{unbroken}>"""
-                "<index>{index}</index>"
-                "<host>{host}</host>"
-                "<source>{source}</source>"
-                "<sourcetype>{sourcetype}</sourcetype>"
-                "<time>{time}</time>"
-                "<data>{data}</data>{done}</event>")
+    if isinstance(data, unicode):
+        data = data.encode("utf-8")
+    elif not isinstance(data, str):
+        data = json.dumps(data)
 
-    event_fmt = base_fmt.replace("{unbroken}", "").replace("{done}", "")
-    unbroken_fmt = base_fmt.replace("{unbroken}", ' unbroken="1"').replace(
-        "{done}", "")
-    done_fmt = base_fmt.replace("{unbroken}", ' unbroken="1"').replace(
-        "{done}", "<done/>")
+    # Most events have nothing to escape, look for it in one pass
+    if _xml_special_chars.search(data) is None:
+        return data
+    return data.replace("&", "&amp;").replace("<", "&lt;").replace(
+        ">", "&gt;")
+
+
+class ModinputEvent(object):
+    """
+    Modular input XML stream of events which share index, host, source and
+    sourcetype. The markup around the event time and data is rendered once
+    for each metadata and reused by all events, empty metadata is left out
+    """
+
+    _markup_cache = {}
+    _max_markup_cache_size = 1024
 
     def __init__(self, index, host, source, sourcetype, time,
                  unbroken, done, events):
         self._string_events = self._format_events(
             index, host, source, sourcetype, time, events, unbroken, done)
 
+    @classmethod
+    def _get_markup(cls, index, host, source, sourcetype, unbroken, done):
+        """
+        :return: (head, tail), head is the markup before <time>, tail is the
+        markup after </data>
+        """
+
+        key = (index, host, source, sourcetype, bool(unbroken), bool(done))
+        markup = cls._markup_cache.get(key)
+        if markup is not None:
+            return markup
+
+        if unbroken or done:
+            head = ['<event unbroken="1">']
+        else:
+            head = ["<event>"]
+        for tag, value in (("index", index), ("host", host),
+                           ("source", source), ("sourcetype", sourcetype)):
+            if value:
+                head.append("<{0}>{1}</{0}>".format(tag, _escape_data(value)))
+
+        if done:
+            tail = "</data><done/></event>"
+        else:
+            tail = "</data></event>"
+
+        if len(cls._markup_cache) >= cls._max_markup_cache_size:
+            cls._markup_cache.clear()
+        markup = cls._markup_cache[key] = ("".join(head), tail)
+        return markup
+
     def _format_events(self, index, host, source, sourcetype, time,
                        events, unbroken, done):
-        evt_fmt = self.event_fmt
-        if done:
-            evt_fmt = self.done_fmt
-        elif unbroken:
-            evt_fmt = self.unbroken_fmt
-
-        if isinstance(events, (list, tuple)):
-            res = "".join([self._do_format(
-                evt, evt_fmt, index, host, source, sourcetype, time)
-                for evt in events])
-        elif isinstance(events, (str, unicode)):
-            res = self._do_format(
-                events, evt_fmt, index, host, source, sourcetype, time)
+        head, tail = self._get_markup(
+            index, host, source, sourcetype, unbroken, done)
+
+        if isinstance(events, (str, unicode)):
+            events = (events,)
         else:
-            assert 0
+            assert isinstance(events, (list, tuple))
 
-        return "<stream>{}</stream>".format(res)
+        if isinstance(time, (list, tuple)):
+            # One time per event, repr keeps the sub-second precision
+            parts = ["<stream>"]
+            for evt, evt_time in itertools.izip(events, time):
+                parts.append(head)
+                if evt_time is not None:
+                    if isinstance(evt_time, float):
+                        evt_time = repr(evt_time)
+                    parts.append("<time>{}</time>".format(evt_time))
+                parts.append("<data>")
+                parts.append(_escape_data(evt))
+                parts.append(tail)
+        else:
+            if time is not None:
+                head = "{}<time>{}</time><data>".format(head, time)
+            else:
+                head = "{}<data>".format(head)
+            parts = ["<stream>"]
+            for evt in events:
+                parts.append(head)
+                parts.append(_escape_data(evt))
+                parts.append(tail)
+        parts.append("</stream>")
 
-    def _do_format(self, evt, evt_fmt, index, host, source, sourcetype, time):
-        evt = scutil.escape_cdata(evt)
-        res = evt_fmt.format(index=index, host=host, source=source,
-                             sourcetype=sourcetype, time=time, data=evt)
-        return res
+        # join sizes the result once and copies every part into it
+        return "".join(parts)
 
     def to_string(self):
         return self._string_events
@@ -71,13 +135,45 @@ class ModinputEvent(object):
 
 class ModinputEventWriter(object):
 
-    def __init__(self, process_safe=False):
+    def __init__(self, process_safe=False, spill_path=None,
+                 max_spill_bytes=1024 ** 3, shm_ring_bytes=0):
+        """
+        :param spill_path: when it is set, batches which don't fit in the
+        memory queue are spilled to this file and written later in order.
+        Batches are delivered once spilled, spilled batches which are not
+        written yet are left in the file at tear down and written first
+        at the next start. Not supported in multiprocess mode
+        :param shm_ring_bytes: in multiprocess mode, when it is not 0,
+        loader processes render their events and hand them over through
+        a shared memory ring of this size instead of a Manager queue
+        """
+
+        self._spill_queue = None
+        self._ring = None
         if process_safe:
-            self._mgr = multiprocessing.Manager()
-            self._event_queue = self._mgr.Queue(1000)
+            if spill_path:
+                logger.warn("Spilling events is not supported when "
+                            "use_multiprocess is 1")
+            if shm_ring_bytes:
+                self._ring = sshm.SharedMemoryRing(shm_ring_bytes)
+            else:
+                self._mgr = multiprocessing.Manager()
+                self._event_queue = self._mgr.Queue(1000)
+        elif spill_path:
+            self._spill_queue = ssq.SpillQueue(
+                spill_path, 1000, max_spill_bytes, dumps=self._dumps_item,
+                loads=self._loads_item)
+            self._event_queue = self._spill_queue
         else:
             self._event_queue = Queue.Queue(1000)
-        self._event_writer = threading.Thread(target=self._do_write_events)
+        self._process_safe = process_safe
+        if self._ring is not None:
+            self._event_writer = threading.Thread(
+                target=self._do_write_ring_events)
+        else:
+            self._event_writer = threading.Thread(
+                target=self._do_write_events)
+        self._stopping = False
         self._started = False
 
     def start(self):
@@ -93,27 +189,87 @@ class ModinputEventWriter(object):
             return
         self._started = False
 
-        self._event_queue.put(None)
-        self._event_writer.join()
+        if self._spill_queue is not None:
+            self._spill_queue.put_memory(None)
+            self._event_writer.join()
+            self._spill_queue.close()
+        elif self._ring is not None:
+            self._stopping = True
+            self._event_writer.join()
+        else:
+            self._event_queue.put(None)
+            self._event_writer.join()
         logger.info("ModinputEventWriter stopped.")
 
-    def write_events(self, events, retry=3):
+    def write_events(self, events, retry=3, callback=None):
         """
         :param evetns: list of ModinputEvent objects
+        :param callback: callable, called without params after the events
+        have been written to stdout. In multiprocess mode callables can't
+        cross the process boundary, the callback is called when the events
+        have been handed over to the writer process
         """
 
         if events is None:
             return
 
-        self._event_queue.put(events)
+        if self._ring is not None:
+            self._ring.put(self._dumps_item((events, None)))
+            if callback is not None:
+                callback()
+        elif self._process_safe:
+            self._event_queue.put((events, None))
+            if callback is not None:
+                callback()
+        elif self._spill_queue is not None:
+            if self._spill_queue.put((events, callback)) and callback:
+                callback()
+        else:
+            self._event_queue.put((events, callback))
+
+    @staticmethod
+    def _dumps_item(item):
+        events = item[0]
+        if isinstance(events, unicode):
+            return events.encode("utf-8")
+        elif isinstance(events, str):
+            return events
+        return "".join(event.to_string() for event in events)
+
+    @staticmethod
+    def _loads_item(data):
+        return data, None
 
     @staticmethod
     def create_events(index, host, source, sourcetype, time, unbroken,
                       done, events):
+        """
+        :param time: event time for all events, or a list of event times,
+        one for each event
+        """
+
         return [ModinputEvent(index=index, host=host, source=source,
                               sourcetype=sourcetype, time=time,
                               unbroken=unbroken, done=done, events=events)]
 
+    def _do_write_ring_events(self):
+        ring = self._ring
+        write = sys.stdout.write
+
+        while 1:
+            slices, size = ring.get(timeout=3)
+            if not size:
+                # We need drain the ring before shutdown
+                # timeout means empty for now
+                if self._stopping:
+                    logger.info("ModinputEventWriter is going to exit...")
+                    break
+                continue
+
+            for data in slices:
+                write(data)
+            ring.consume(size)
+
     def _do_write_events(self):
         event_queue = self._event_queue
         write = sys.stdout.write
@@ -121,7 +277,7 @@ class ModinputEventWriter(object):
 
         while 1:
             try:
-                events = event_queue.get(timeout=3)
+                item = event_queue.get(timeout=3)
             except Queue.Empty:
                 # We need drain the queue before shutdown
                 # timeout means empty for now
@@ -131,16 +287,283 @@ class ModinputEventWriter(object):
                 else:
                     continue
 
-            if events is not None:
+            if item is not None:
+                events, callback = item
                 if isinstance(events, (str, unicode)):
                     # for legacy interface
                     write(events)
                 else:
                     for event in events:
                         write(event.to_string())
+
+                if callback is not None:
+                    try:
+                        callback()
+                    except Exception:
+                        logger.error("Failed to call delivery callback, "
+                                     "error=%s", traceback.format_exc())
             else:
                 logger.info("ModinputEventWriter got tear down signal")
                 got_shutdown_signal = True
+                if self._spill_queue is not None:
+                    self._spill_queue.stop_replay()
+
+
+class HecAckTracker(object):
+    """
+    Track the ackIds HEC returns for posts on a channel with indexer
+    acknowledgement enabled. Ack status is polled from
+    /services/collector/ack in batches every poll_interval seconds, the
+    callback of a post is called once the indexers confirm it, in the order
+    of track. Posted bodies are kept until then and posted again when they
+    are not confirmed within ack_timeout seconds, so events may be indexed
+    twice. A body which fails to be posted again max_replays times is
+    dropped, its drop_callback is called instead of its callback, in the
+    same order. So are the bodies not confirmed within drain_timeout
+    seconds after tear_down. track blocks when the kept bodies exceed
+    max_buffer_bytes.
+    """
+
+    def __init__(self, config, uri, headers):
+        """
+        :params config: dict, same as HecEventWriter and optionally
+        {
+        "hec_ack_poll_interval": 5,
+        "hec_ack_timeout": 300,
+        "hec_ack_buffer_bytes": 67108864,
+        "hec_ack_batch_size": 1000,
+        "hec_ack_max_replays": 3,
+        "hec_ack_drain_timeout": 10,
+        }
+        :params uri: URI the bodies are posted to
+        :params headers: default headers the bodies are posted with,
+        including the channel
+        """
+
+        self._config = config
+        self._uri = uri
+        self._headers = headers
+        self._ack_uri = "{host}/services/collector/ack".format(
+            host=config["hec_server_uri"])
+        self._ack_headers = dict(headers)
+        self._ack_headers.pop("Content-Encoding", None)
+        self._poll_interval = float(config.get("hec_ack_poll_interval", 5))
+        self._ack_timeout = float(config.get("hec_ack_timeout", 300))
+        self._max_buffer_bytes = int(
+            config.get("hec_ack_buffer_bytes", 64 * 1024 * 1024))
+        self._ack_batch_size = int(config.get("hec_ack_batch_size", 1000))
+        self._max_replays = int(config.get("hec_ack_max_replays", 3))
+        self._drain_timeout = float(config.get("hec_ack_drain_timeout", 10))
+
+        self._cond = threading.Condition(threading.Lock())
+        # ackId -> [seq, body, callback, post time, headers, failed replays,
+        # drop callback]
+        self._pending = {}
+        self._buffer_bytes = 0
+        self._seq = 0
+        # seq -> callback of confirmed posts
+        self._confirmed = {}
+        self._next_release_seq = 0
+
+        self._http = None
+        self._poller = threading.Thread(target=self._do_poll)
+        self._poller.daemon = True
+        self._started = False
+        self._stopped = False
+
+    def start(self):
+        if self._started:
+            return
+        self._started = True
+        self._poller.start()
+
+    def tear_down(self):
+        """
+        Wait at most drain_timeout seconds for the pending acks, posts which
+        are not confirmed by then are dropped
+        """
+
+        if not self._started:
+            return
+        self._started = False
+
+        self._stopped = True
+        with self._cond:
+            self._cond.notify_all()
+        self._poller.join()
+        self._drop_pending()
+
+    def track(self, content, body, callback, headers=None,
+              drop_callback=None):
+        """
+        :params content: response content of posting body
+        :params body: posted body
+        :params callback: callable or None
+        :params headers: headers body was posted with, the default headers
+        when it is None. They are used to post body again
+        :params drop_callback: callable or None, called when body is dropped
+        """
+
+        ack_id = self._get_ack_id(content)
+        with self._cond:
+            seq = self._seq
+            self._seq += 1
+            if ack_id is None:
+                logger.warn("HEC returned no ackId, is indexer "
+                            "acknowledgement enabled for the token?")
+                self._release_with_lock(seq, callback)
+                return
+
+            while (self._pending and not self._stopped and
+                   self._buffer_bytes + len(body) > self._max_buffer_bytes):
+                self._cond.wait(1)
+            self._pending[ack_id] = [seq, body, callback, time.time(),
+                                     headers or self._headers, 0,
+                                     drop_callback]
+            self._buffer_bytes += len(body)
+
+    @staticmethod
+    def _get_ack_id(content):
+        try:
+            return json.loads(content).get("ackId")
+        except Exception:
+            return None
+
+    def _release_with_lock(self, seq, callback):
+        self._confirmed[seq] = callback
+        while self._next_release_seq in self._confirmed:
+            callback = self._confirmed.pop(self._next_release_seq)
+            self._next_release_seq += 1
+            if callback is None:
+                continue
+
+            try:
+                callback()
+            except Exception:
+                logger.error("Failed to call delivery callback, error=%s",
+                             traceback.format_exc())
+
+    def _do_poll(self):
+        self._http = sr.build_http_connection(
+            self._config, disable_ssl_validation=True)
+        deadline = None
+        while 1:
+            with self._cond:
+                timeout = self._poll_interval
+                if self._stopped:
+                    if deadline is None:
+                        deadline = time.time() + self._drain_timeout
+                    timeout = min(timeout, deadline - time.time())
+                    if not self._pending or timeout <= 0:
+                        break
+                self._cond.wait(timeout)
+                ack_ids = sorted(self._pending.iterkeys())
+
+            for i in xrange(0, len(ack_ids), self._ack_batch_size):
+                self._poll_acks(ack_ids[i:i + self._ack_batch_size])
+            if not self._stopped:
+                self._replay_timedout_posts()
+
+    def _poll_acks(self, ack_ids):
+        try:
+            response, content = self._http.request(
+                self._ack_uri, method="POST", headers=self._ack_headers,
+                body=json.dumps({"acks": ack_ids}))
+            if response.status not in (200, 201):
+                raise Exception(
+                    "Failed to poll acks from HEC_URI={}, error_code={}, "
+                    "reason={}".format(
+                        self._ack_uri, response.status, content))
+            acks = json.loads(content)["acks"]
+        except Exception:
+            logger.error("Failed to poll acks from HEC_URI=%s, error=%s",
+                         self._ack_uri, traceback.format_exc())
+            self._http = sr.build_http_connection(
+                self._config, disable_ssl_validation=True)
+            return
+
+        with self._cond:
+            for ack_id, acked in acks.iteritems():
+                if not acked:
+                    continue
+
+                pending = self._pending.pop(int(ack_id), None)
+                if pending is None:
+                    continue
+
+                self._buffer_bytes -= len(pending[1])
+                self._release_with_lock(pending[0], pending[2])
+            self._cond.notify_all()
+
+    def _replay_timedout_posts(self):
+        now = time.time()
+        with self._cond:
+            timedout = [(ack_id, pending)
+                        for ack_id, pending in self._pending.iteritems()
+                        if now - pending[3] >= self._ack_timeout]
+
+        for ack_id, pending in sorted(timedout, key=lambda p: p[1][0]):
+            logger.warn("HEC post of ackId=%s is not acknowledged in %s "
+                        "seconds, post it again", ack_id, self._ack_timeout)
+            try:
+                response, content = self._http.request(
+                    self._uri, method="POST", headers=pending[4],
+                    body=pending[1])
+                if response.status not in (200, 201):
+                    raise Exception(
+                        "Failed to post events to HEC_URI={}, "
+                        "error_code={}, reason={}".format(
+                            self._uri, response.status, content))
+            except Exception:
+                logger.error("Failed to post events to HEC_URI=%s, "
+                             "error=%s", self._uri, traceback.format_exc())
+                self._http = sr.build_http_connection(
+                    self._config, disable_ssl_validation=True)
+                self._drop_if_replayed_too_often(ack_id, pending)
+                continue
+
+            new_ack_id = self._get_ack_id(content)
+            with self._cond:
+                if self._pending.pop(ack_id, None) is None:
+                    # Confirmed meanwhile
+                    continue
+
+                pending[3] = time.time()
+                if new_ack_id is None:
+                    self._buffer_bytes -= len(pending[1])
+                    self._release_with_lock(pending[0], pending[2])
+                else:
+                    self._pending[new_ack_id] = pending
+
+    def _drop_if_replayed_too_often(self, ack_id, pending):
+        with self._cond:
+            pending[5] += 1
+            if pending[5] < self._max_replays:
+                return
+
+            if self._pending.pop(ack_id, None) is None:
+                # Confirmed meanwhile
+                return
+
+            logger.error("Drop HEC post of ackId=%s after %d failed replays",
+                         ack_id, pending[5])
+            self._buffer_bytes -= len(pending[1])
+            self._release_with_lock(pending[0], pending[6])
+            self._cond.notify_all()
+
+    def _drop_pending(self):
+        with self._cond:
+            if not self._pending:
+                return
+
+            logger.warn("Drop %d HEC posts which are not acknowledged by "
+                        "indexers", len(self._pending))
+            pendings = sorted(self._pending.itervalues(), key=lambda p: p[0])
+            self._pending.clear()
+            self._buffer_bytes = 0
+            for pending in pendings:
+                self._release_with_lock(pending[0], pending[6])
+            self._cond.notify_all()
 
 
 class HecEventWriter(object):
@@ -158,13 +581,25 @@ class HecEventWriter(object):
         "proxy_password": cc,
         "proxy_type": http,http_no_tunnel,sock4,sock5,
         "proxy_rdns": 0 or 1,
+        "hec_ack": 0 or 1,
+        "channel": uuid,
         }
+        When hec_ack is 1, callbacks are called after the indexers
+        acknowledged the events, see HecAckTracker. channel is generated
+        when it is not set
         """
 
         self._config = config
+        if scutil.is_true(config.get("hec_ack")) and not config.get("channel"):
+            config["channel"] = str(uuid.uuid4())
         self._http = sr.build_http_connection(
             config, disable_ssl_validation=True)
         self._compose_uri_headers(config)
+        self._ack_tracker = None
+        if scutil.is_true(config.get("hec_ack")):
+            self._headers["x-splunk-request-channel"] = config["channel"]
+            self._ack_tracker = HecAckTracker(
+                config, self._uri, self._headers)
 
     def _compose_uri_headers(self, config):
         self._uri = "{host}/services/collector".format(
@@ -182,7 +617,7 @@ class HecEventWriter(object):
 
         return "\n".join(json.dumps(evt) for evt in events)
 
-    def write_events(self, events, retry=3):
+    def write_events(self, events, retry=3, callback=None):
         """
         :params: events a list of json dict which meets HEC event schema
         {
@@ -195,6 +630,8 @@ class HecEventWriter(object):
         }
         Clients should consider batching, since when batching here, upper layer
         may have data loss
+        :param callback: callable, called without params after HEC accepted
+        the events
         """
 
         last_ex = None
@@ -205,7 +642,7 @@ class HecEventWriter(object):
                     self._uri, method="POST", headers=self._headers,
                     body=events)
                 if response.status in (200, 201):
-                    return
+                    break
                 else:
                     msg = ("Failed to post events to HEC_URI={}, "
                            "error_code={}, reason={}").format(
@@ -220,32 +657,275 @@ class HecEventWriter(object):
                 self._http = sr.build_http_connection(
                     self._config, disable_ssl_validation=True)
                 time.sleep(2)
-        raise last_ex
+        else:
+            raise last_ex
+
+        if self._ack_tracker is not None:
+            self._ack_tracker.track(
+                content, events, callback, headers=self._headers)
+        elif callback is not None:
+            callback()
 
     def start(self):
-        pass
+        if self._ack_tracker is not None:
+            self._ack_tracker.start()
 
     def tear_down(self):
-        pass
+        if self._ack_tracker is not None:
+            self._ack_tracker.tear_down()
 
     @staticmethod
     def create_events(index, host, source, sourcetype,
                       time, unbroken, done, events):
+        """
+        :param time: event time for all events, or a list of event times,
+        one for each event
+        """
+
         keys = [index, host, source, sourcetype, time]
         for i, key in enumerate(keys):
             if not key:
                 keys[i] = None
         index, host, source, sourcetype, time = keys
 
+        if isinstance(time, (list, tuple)):
+            times = time
+        else:
+            times = itertools.repeat(time)
+
         return [
             {
                 "index": index,
                 "host": host,
                 "source": source,
                 "sourcetype": sourcetype,
-                "time": time,
+                "time": evt_time,
                 "event": event,
-            } for event in events]
+            } for event, evt_time in itertools.izip(events, times)]
+
+
+class AsyncHecEventWriter(HecEventWriter):
+    """
+    HecEventWriter which posts from a pool of sender threads. Events of all
+    write_events calls are coalesced into batches of up to max_batch_bytes,
+    a batch is posted when it is full or when its oldest events waited
+    max_latency seconds. Bodies are gzipped and each sender keeps its own
+    keep-alive connection. write_events blocks when max_pending_batches
+    batches are waiting for senders. Failed posts are retried until the
+    writer is torn down. Callbacks are called in the order of write_events
+    once HEC accepted the events, and no more callbacks are called after a
+    batch is given up.
+    """
+
+    def __init__(self, config):
+        """
+        :params config: dict, same as HecEventWriter and optionally
+        {
+        "hec_senders": 4,
+        "hec_batch_bytes": 1048576,
+        "hec_max_latency": 0.5,
+        "hec_max_pending_batches": 8,
+        "hec_gzip": 1,
+        }
+        """
+
+        super(AsyncHecEventWriter, self).__init__(config)
+        sender_count = max(int(config.get("hec_senders", 4)), 1)
+        self._max_batch_bytes = int(config.get("hec_batch_bytes", 1048576))
+        self._max_latency = float(config.get("hec_max_latency", 0.5))
+        self._gzip = scutil.is_true(config.get("hec_gzip", 1))
+        if self._gzip:
+            self._headers = dict(self._headers)
+            self._headers["Content-Encoding"] = "gzip"
+        self._batch_queue = Queue.Queue(max(int(config.get(
+            "hec_max_pending_batches", sender_count * 2)), 1))
+
+        self._lock = threading.Lock()
+        self._batch = []
+        self._batch_bytes = 0
+        self._batch_callbacks = []
+        self._batch_start = 0
+        self._batch_seq = 0
+
+        # batch seq -> callbacks, None if the batch is given up
+        self._posted = {}
+        self._next_release_seq = 0
+        self._given_up = False
+        self._release_lock = threading.Lock()
+
+        self._senders = []
+        for i in xrange(sender_count):
+            thr = threading.Thread(
+                target=self._do_send, name="hec_sender_{}".format(i))
+            thr.daemon = True
+            self._senders.append(thr)
+        self._flusher = threading.Thread(target=self._do_flush)
+        self._flusher.daemon = True
+        self._started = False
+        self._stopped = False
+
+    def start(self):
+        if self._started:
+            return
+        self._started = True
+
+        super(AsyncHecEventWriter, self).start()
+        for thr in self._senders:
+            thr.start()
+        self._flusher.start()
+        logger.info("AsyncHecEventWriter started.")
+
+    def tear_down(self):
+        """
+        Post the pending events and stop
+        """
+
+        if not self._started:
+            return
+        self._started = False
+
+        self._flush()
+        self._stopped = True
+        self._flusher.join()
+        for _ in self._senders:
+            self._batch_queue.put(None)
+        for thr in self._senders:
+            thr.join()
+        super(AsyncHecEventWriter, self).tear_down()
+        logger.info("AsyncHecEventWriter stopped.")
+
+    def write_events(self, events, retry=3, callback=None):
+        """
+        Same as HecEventWriter.write_events, except that the events are
+        posted in background and callback is called after that
+        """
+
+        body = self._prepare_events(events)
+        batch = None
+        with self._lock:
+            if not self._batch and not self._batch_callbacks:
+                self._batch_start = time.time()
+            if body:
+                self._batch.append(body)
+                self._batch_bytes += len(body) + 1
+            if callback is not None:
+                self._batch_callbacks.append(callback)
+            if self._batch_bytes >= self._max_batch_bytes:
+                batch = self._take_batch_with_lock()
+
+        if batch is not None:
+            self._batch_queue.put(batch)
+
+    def _take_batch_with_lock(self):
+        if not self._batch and not self._batch_callbacks:
+            return None
+
+        batch = (self._batch_seq, self._batch, self._batch_callbacks)
+        self._batch_seq += 1
+        self._batch, self._batch_bytes, self._batch_callbacks = [], 0, []
+        return batch
+
+    def _flush(self):
+        with self._lock:
+            batch = self._take_batch_with_lock()
+
+        if batch is not None:
+            self._batch_queue.put(batch)
+
+    def _do_flush(self):
+        interval = max(self._max_latency / 2, 0.01)
+        while not self._stopped:
+            time.sleep(interval)
+            with self._lock:
+                if time.time() - self._batch_start < self._max_latency:
+                    continue
+                batch = self._take_batch_with_lock()
+
+            if batch is not None:
+                self._batch_queue.put(batch)
+
+    def _compress(self, body):
+        if not self._gzip:
+            return body
+
+        if isinstance(body, unicode):
+            body = body.encode("utf-8")
+        compressor = zlib.compressobj(6, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+        return compressor.compress(body) + compressor.flush()
+
+    def _do_send(self):
+        http = sr.build_http_connection(
+            self._config, disable_ssl_validation=True)
+        while 1:
+            batch = self._batch_queue.get()
+            if batch is None:
+                break
+
+            seq, bodies, callbacks = batch
+            if not bodies:
+                self._release(seq, callbacks)
+                continue
+
+            body = self._compress("\n".join(bodies))
+            failures = 0
+            while 1:
+                try:
+                    response, content = http.request(
+                        self._uri, method="POST", headers=self._headers,
+                        body=body)
+                    if response.status in (200, 201):
+                        break
+                    else:
+                        raise Exception(
+                            "Failed to post events to HEC_URI={}, "
+                            "error_code={}, reason={}".format(
+                                self._uri, response.status, content))
+                except Exception:
+                    failures += 1
+                    logger.error("Failed to post events to HEC_URI=%s, "
+                                 "error=%s", self._uri, traceback.format_exc())
+                    if self._stopped and failures >= 3:
+                        logger.error("Give up %d events to HEC_URI=%s",
+                                     len(bodies), self._uri)
+                        callbacks = None
+                        break
+
+                    http = sr.build_http_connection(
+                        self._config, disable_ssl_validation=True)
+                    time.sleep(2)
+
+            if callbacks is not None and self._ack_tracker is not None:
+                self._ack_tracker.track(
+                    content, body,
+                    lambda seq=seq, callbacks=callbacks: self._release(
+                        seq, callbacks),
+                    headers=self._headers,
+                    # Later batches are still released
+                    drop_callback=lambda seq=seq: self._release(seq, []))
+            else:
+                self._release(seq, callbacks)
+
+    def _release(self, seq, callbacks):
+        """
+        Call the callbacks of posted batches in batch order
+        """
+
+        with self._release_lock:
+            self._posted[seq] = callbacks
+            while self._next_release_seq in self._posted:
+                callbacks = self._posted.pop(self._next_release_seq)
+                self._next_release_seq += 1
+                if callbacks is None:
+                    self._given_up = True
+                if self._given_up:
+                    continue
+
+                for callback in callbacks:
+                    try:
+                        callback()
+                    except Exception:
+                        logger.error("Failed to call delivery callback, "
+                                     "error=%s", traceback.format_exc())
 
 
 class RawHecEventWriter(HecEventWriter):
@@ -279,12 +959,29 @@ class RawHecEventWriter(HecEventWriter):
 
 
 def create_event_writer(config, process_safe=False):
+    if process_safe and scutil.is_true(config.get("hec_ack")):
+        # Ack poller can't track posts of loaders in other processes
+        logger.warn("HEC indexer acknowledgement is not supported "
+                    "when use_multiprocess is 1")
+        config = dict(config)
+        config["hec_ack"] = 0
+
     if scutil.is_true(config.get("use_hec")):
+        # Sender threads can't serve loaders in other processes
+        if not process_safe and int(config.get("hec_senders", 0)) > 0:
+            return AsyncHecEventWriter(config)
         return HecEventWriter(config)
     elif scutil.is_true(config.get("use_raw_hec")):
         return RawHecEventWriter(config)
     else:
-        return ModinputEventWriter(process_safe=process_safe)
+        spill_path = None
+        if scutil.is_true(config.get("modinput_spill")):
+            spill_path = op.join(config["checkpoint_dir"], "modinput_spill.dat")
+        return ModinputEventWriter(
+            process_safe=process_safe, spill_path=spill_path,
+            max_spill_bytes=int(
+                config.get("modinput_max_spill_bytes", 1024 ** 3)),
+            shm_ring_bytes=int(config.get("modinput_shm_bytes", 0)))
 
 
 if __name__ == "__main__":
@@ -0,0 +1,88 @@
+"""
+A byte stream from many processes to one consumer over shared memory
+"""
+
+import ctypes
+import mmap
+import multiprocessing
+
+
+class SharedMemoryRing(object):
+    """
+    Ring buffer in an anonymous shared memory map, which is inherited by the
+    processes forked after it is created. Producers copy their data into the
+    ring, one producer at a time, so the data of a put is contiguous in the
+    stream. The consumer gets zero copy buffer slices of the pending bytes
+    and consumes them after use. put blocks when the ring is full.
+    """
+
+    def __init__(self, capacity=64 * 1024 * 1024):
+        self._capacity = capacity
+        self._mm = mmap.mmap(-1, capacity)
+        self._addr = ctypes.addressof(ctypes.c_char.from_buffer(self._mm))
+        # Total bytes consumed and produced, head <= tail <= head + capacity
+        self._head = multiprocessing.RawValue(ctypes.c_ulonglong, 0)
+        self._tail = multiprocessing.RawValue(ctypes.c_ulonglong, 0)
+        self._put_lock = multiprocessing.Lock()
+        self._cond = multiprocessing.Condition(multiprocessing.Lock())
+
+    def put(self, data):
+        """
+        :param data: str
+        """
+
+        if isinstance(data, unicode):
+            data = data.encode("utf-8")
+
+        src = ctypes.cast(ctypes.c_char_p(data), ctypes.c_void_p).value
+        start, total = 0, len(data)
+        with self._put_lock:
+            while start < total:
+                with self._cond:
+                    while self._tail.value - self._head.value >= \
+                            self._capacity:
+                        self._cond.wait()
+                    tail = self._tail.value
+                    free = self._capacity - (tail - self._head.value)
+
+                # The consumer doesn't touch the free space, copy without lock
+                pos = tail % self._capacity
+                size = min(total - start, free, self._capacity - pos)
+                ctypes.memmove(self._addr + pos, src + start, size)
+                start += size
+
+                with self._cond:
+                    self._tail.value = tail + size
+                    self._cond.notify_all()
+
+    def get(self, timeout=None):
+        """
+        :return: (slices, size), slices are buffer objects of the pending
+        bytes in order, they are valid until consume(size) is called.
+        ([], 0) when nothing is pending in timeout seconds
+        """
+
+        with self._cond:
+            if self._tail.value == self._head.value:
+                self._cond.wait(timeout)
+            head, tail = self._head.value, self._tail.value
+
+        size = tail - head
+        if not size:
+            return [], 0
+
+        pos = head % self._capacity
+        first = min(size, self._capacity - pos)
+        slices = [buffer(self._mm, pos, first)]
+        if size > first:
+            slices.append(buffer(self._mm, 0, size - first))
+        return slices, size
+
+    def consume(self, size):
+        with self._cond:
+            self._head.value += size
+            self._cond.notify_all()
+
+    def pending_bytes(self):
+        with self._cond:
+            return self._tail.value - self._head.value
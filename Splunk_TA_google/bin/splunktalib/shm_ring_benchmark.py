@@ -0,0 +1,105 @@
+"""
+Benchmark how fast loader processes hand event batches over to the stdout
+writer in multiprocess mode, through the Manager queue and through the
+shared memory ring. Each process writes the same batches, the clock stops
+when the writer has written all of them.
+
+Usage:
+    python -m splunktalib.shm_ring_benchmark --processes 4 --batches 2000
+"""
+
+import argparse
+import multiprocessing
+import sys
+import time
+
+import splunktalib.event_writer as ew
+
+
+_event_time = 1476835200
+
+
+class _CountingStdout(object):
+
+    def __init__(self):
+        self.written = 0
+
+    def write(self, data):
+        self.written += len(data)
+
+    def flush(self):
+        pass
+
+
+def _produce(writer, batches, events):
+    for _ in xrange(batches):
+        writer.write_events(writer.create_events(
+            index="main", host="bench", source="bench",
+            sourcetype="google:bench", time=_event_time, unbroken=False,
+            done=False, events=events))
+
+
+def run(processes, batches, events, shm_ring_bytes):
+    """
+    :return: (seconds, total bytes)
+    """
+
+    stdout = _CountingStdout()
+    sys.stdout, real_stdout = stdout, sys.stdout
+    try:
+        writer = ew.ModinputEventWriter(
+            process_safe=True, shm_ring_bytes=shm_ring_bytes)
+        batch_bytes = len("".join(evt.to_string() for evt in
+                                  writer.create_events(
+                                      "main", "bench", "bench",
+                                      "google:bench", _event_time, False,
+                                      False, events)))
+        total = batch_bytes * batches * processes
+        writer.start()
+
+        start = time.time()
+        workers = [multiprocessing.Process(
+            target=_produce, args=(writer, batches, events))
+            for _ in xrange(processes)]
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+        while stdout.written < total:
+            time.sleep(0.001)
+        elapsed = time.time() - start
+        writer.tear_down()
+    finally:
+        sys.stdout = real_stdout
+    return elapsed, total
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Benchmark multiprocess event transports")
+    parser.add_argument("--processes", type=int, default=4)
+    parser.add_argument("--batches", type=int, default=2000)
+    parser.add_argument("--events", type=int, default=100,
+                        help="events per batch")
+    parser.add_argument("--event-size", type=int, default=512)
+    parser.add_argument("--shm-ring-bytes", type=int,
+                        default=64 * 1024 * 1024)
+    args = parser.parse_args()
+
+    payload = "x" * max(args.event_size - 40, 0)
+    events = ['{{"seq": {}, "payload": "{}"}}'.format(i, payload)
+              for i in xrange(args.events)]
+
+    for name, shm_ring_bytes in (("manager_queue", 0),
+                                 ("shm_ring", args.shm_ring_bytes)):
+        elapsed, total = run(
+            args.processes, args.batches, events, shm_ring_bytes)
+        print "{}: {} batches, {:.1f} MB in {:.2f}s, {:.1f} MB/s, " \
+            "{:.0f} batches/s".format(
+                name, args.processes * args.batches, total / 1048576.0,
+                elapsed, total / 1048576.0 / elapsed,
+                args.processes * args.batches / elapsed)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,199 @@
+"""
+A FIFO queue which spills to a memory mapped file when it is full
+"""
+
+import os.path as op
+import mmap
+import struct
+import threading
+import Queue
+
+from splunktalib.common import log
+
+logger = log.Logs().get_logger("util")
+
+
+class SpillFile(object):
+    """
+    Append only file of length prefixed segments, memory mapped. The header
+    keeps the offsets of the oldest unread segment and of the end of the
+    segments, so unread segments survive a restart. Unread segments are
+    moved to the front once the read space is at least as large as them,
+    which keeps the file within a few times the unread bytes.
+    """
+
+    magic = "GSPL0001"
+    header = struct.Struct("<8sQQ")
+    seg_header = struct.Struct("<I")
+    data_offset = 64
+    initial_size = 1024 * 1024
+
+    def __init__(self, path):
+        self._path = path
+        if op.exists(path) and op.getsize(path) >= self.data_offset:
+            self._file = open(path, "r+b")
+        else:
+            self._file = open(path, "w+b")
+            self._file.truncate(self.initial_size)
+        self._mm = mmap.mmap(self._file.fileno(), 0)
+
+        magic, self._read, self._write = self.header.unpack_from(self._mm, 0)
+        if (magic != self.magic or
+                not self.data_offset <= self._read <= self._write <=
+                len(self._mm)):
+            if magic != "\x00" * len(self.magic):
+                logger.error("Invalid spill file=%s, discard it", path)
+            self._read = self._write = self.data_offset
+            self._update_header()
+        elif self._write > self._read:
+            logger.info("Spill file=%s has %d pending bytes",
+                        path, self._write - self._read)
+
+    def pending_bytes(self):
+        return self._write - self._read
+
+    def append(self, data):
+        end = self._write + self.seg_header.size + len(data)
+        if (end > len(self._mm) and
+                self._read - self.data_offset >= self.pending_bytes()):
+            self._compact()
+            end = self._write + self.seg_header.size + len(data)
+        if end > len(self._mm):
+            self._mm.resize(max(len(self._mm) * 2, end))
+
+        self.seg_header.pack_into(self._mm, self._write, len(data))
+        self._mm[self._write + self.seg_header.size:end] = data
+        self._write = end
+        self._update_header()
+
+    def pop(self):
+        """
+        :return: the oldest unread segment, None if there is none
+        """
+
+        if self._read == self._write:
+            return None
+
+        size, = self.seg_header.unpack_from(self._mm, self._read)
+        start = self._read + self.seg_header.size
+        data = self._mm[start:start + size]
+        self._read = start + size
+        if self._read - self.data_offset >= max(
+                self.pending_bytes(), self.initial_size):
+            self._compact()
+        else:
+            self._update_header()
+        return data
+
+    def flush(self):
+        self._mm.flush()
+
+    def close(self):
+        self._mm.flush()
+        self._mm.close()
+        self._file.close()
+
+    def _compact(self):
+        pending = self.pending_bytes()
+        if pending:
+            # Not overlapping when the read space is larger, the old copy
+            # stays valid until the header points to the new one
+            self._mm.move(self.data_offset, self._read, pending)
+        self._read, self._write = self.data_offset, self.data_offset + pending
+        self._update_header()
+
+        size = max(self.initial_size, self._write * 2)
+        if len(self._mm) > size:
+            self._mm.resize(size)
+
+    def _update_header(self):
+        self.header.pack_into(self._mm, 0, self.magic, self._read, self._write)
+
+
+class SpillQueue(object):
+    """
+    Queue.Queue like FIFO. Items are kept in memory up to maxsize, when
+    memory is full or earlier items are spilled, items are dumped to a
+    SpillFile instead. get returns memory items first, then the spilled
+    ones loaded back, which keeps items in put order. put blocks when the
+    spill file reaches max_spill_bytes.
+    """
+
+    def __init__(self, path, maxsize=1000, max_spill_bytes=1024 ** 3,
+                 dumps=str, loads=str):
+        """
+        :param path: spill file path
+        :param dumps: callable which dumps an item to str
+        :param loads: callable which loads an item from str
+        """
+
+        self._queue = Queue.Queue(maxsize)
+        self._spill = SpillFile(path)
+        self._max_spill_bytes = max_spill_bytes
+        self._dumps = dumps
+        self._loads = loads
+        self._replay = True
+        self._cond = threading.Condition(threading.Lock())
+
+    def put(self, item):
+        """
+        :return: True if item is spilled, False if it is kept in memory
+        """
+
+        with self._cond:
+            if self._replay and not self._spill.pending_bytes():
+                try:
+                    self._queue.put_nowait(item)
+                    return False
+                except Queue.Full:
+                    pass
+
+            data = self._dumps(item)
+            while (self._spill.pending_bytes() and self._replay and
+                   self._spill.pending_bytes() + len(data) >
+                   self._max_spill_bytes):
+                self._cond.wait(1)
+            self._spill.append(data)
+            return True
+
+    def put_memory(self, item):
+        """
+        Put item in memory, blocks when memory is full
+        """
+
+        self._queue.put(item)
+
+    def get(self, timeout=None):
+        """
+        :raise: Queue.Empty when there is no item in timeout seconds
+        """
+
+        try:
+            return self._queue.get_nowait()
+        except Queue.Empty:
+            pass
+
+        with self._cond:
+            data = self._spill.pop() if self._replay else None
+            if data is not None:
+                self._cond.notify_all()
+        if data is not None:
+            return self._loads(data)
+        return self._queue.get(timeout=timeout)
+
+    def stop_replay(self):
+        """
+        Leave the spilled items in the spill file, items put later are
+        spilled as well
+        """
+
+        with self._cond:
+            self._replay = False
+            self._cond.notify_all()
+
+    def close(self):
+        with self._cond:
+            pending = self._spill.pending_bytes()
+            self._spill.close()
+        if pending:
+            logger.info("%d spilled bytes are left for the next run", pending)
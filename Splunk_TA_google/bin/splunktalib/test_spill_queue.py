@@ -0,0 +1,70 @@
+import os.path as op
+import shutil
+import sys
+import tempfile
+import unittest as ut
+
+sys.path.append("../")
+
+import splunktalib.spill_queue as sq
+
+
+class TestSpillFile(ut.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.path = op.join(self.tmp_dir, "spill")
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def _fill(self, spill, count, size=1000):
+        segments = [str(i).zfill(size) for i in xrange(count)]
+        for segment in segments:
+            spill.append(segment)
+        return segments
+
+    def testGrowWhenReadSpaceIsSmaller(self):
+        spill = sq.SpillFile(self.path)
+        seg_size = 1000 + sq.SpillFile.seg_header.size
+        segments = self._fill(
+            spill, sq.SpillFile.initial_size // seg_size - 1)
+        for i in xrange(10):
+            self.assertEqual(spill.pop(), segments[i])
+        read = spill._read
+
+        # Moving the pending bytes to the front would overlap them
+        more = self._fill(spill, 10)
+        self.assertEqual(spill._read, read)
+        self.assertGreater(len(spill._mm), sq.SpillFile.initial_size)
+        spill.close()
+
+        spill = sq.SpillFile(self.path)
+        for segment in segments[10:] + more:
+            self.assertEqual(spill.pop(), segment)
+        self.assertIsNone(spill.pop())
+        spill.close()
+
+    def testCompactWhenReadSpaceIsLarger(self):
+        spill = sq.SpillFile(self.path)
+        seg_size = 1000 + sq.SpillFile.seg_header.size
+        segments = self._fill(
+            spill, sq.SpillFile.initial_size // seg_size - 1)
+        half = len(segments) // 2 + 1
+        for i in xrange(half):
+            self.assertEqual(spill.pop(), segments[i])
+
+        more = self._fill(spill, 10)
+        self.assertEqual(spill._read, sq.SpillFile.data_offset)
+        self.assertEqual(len(spill._mm), sq.SpillFile.initial_size)
+        spill.close()
+
+        spill = sq.SpillFile(self.path)
+        for segment in segments[half:] + more:
+            self.assertEqual(spill.pop(), segment)
+        self.assertIsNone(spill.pop())
+        spill.close()
+
+
+if __name__ == "__main__":
+    ut.main()